@@ -0,0 +1,102 @@
+"""Benchmarks utils.formatting's sanitisation against the old functions.
+
+Run from the repository root with ``python -m benchmarks.sanitize``.
+"""
+import random
+import timeit
+import unicodedata
+
+from utils.formatting import (
+    Sanitizer,
+    sanitize,
+    sanitize_many,
+    strip_zalgo,
+    strip_zerowidth,
+)
+
+
+def old_strip_zerowidth(text: str) -> str:
+    for c in ['\ufeff', '\u200d', '\u200c', '\u200b']:
+        text = text.replace(c, '')
+    return text
+
+
+def old_strip_zalgo(text: str) -> str:
+    return ''.join(
+        [
+            c
+            for c in unicodedata.normalize('NFD', text)
+            if unicodedata.category(c) not in ['Mn', 'Me']
+        ]
+    )
+
+
+def zalgo(text, rng):
+    marks = [chr(x) for x in range(0x300, 0x370)]
+    return ''.join(
+        c + ''.join(rng.choices(marks, k=rng.randint(3, 12))) for c in text
+    )
+
+
+def messages(count=10_000, seed=0):
+    """Messages in roughly the mix a moderation cog sees.
+
+    Most chat is plain ASCII, then text with accents and emoji, and a small
+    share is zalgo or hides zero-width characters to dodge filters.
+    """
+    rng = random.Random(seed)
+    words = (
+        'hello anyone playing tonight the server is down again lol gg '
+        'thanks for stream nerd'
+    ).split()
+    accented = ['café', 'naïve', 'über', 'señor', 'crème', 'ça', 'déjà vu']
+    emoji = ['\N{THUMBS UP SIGN}', '\N{FACE WITH TEARS OF JOY}', '\U0001f525']
+    result = []
+    for _ in range(count):
+        text = ' '.join(rng.choices(words, k=rng.randint(3, 20)))
+        kind = rng.random()
+        if kind < 0.15:
+            text += ' ' + ' '.join(rng.choices(accented + emoji, k=3))
+        elif kind < 0.18:
+            text = zalgo(text, rng)
+        elif kind < 0.21:
+            text = '\u200b'.join(text)
+        result.append(text)
+    return result
+
+
+def bench(name, func, number=5):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f'{name:<40} {seconds * 1000:8.2f} ms')
+    return seconds
+
+
+def main():
+    texts = messages()
+    for text in texts:
+        assert strip_zerowidth(text) == old_strip_zerowidth(text)
+        assert strip_zalgo(text) == old_strip_zalgo(text)
+        assert sanitize(text) == old_strip_zalgo(old_strip_zerowidth(text))
+    sanitize('\u0300')  # build the tables outside of the timings
+
+    print(f'{len(texts)} messages')
+    bench(
+        'old strip_zerowidth + strip_zalgo',
+        lambda: [old_strip_zalgo(old_strip_zerowidth(x)) for x in texts],
+    )
+    bench(
+        'strip_zerowidth + strip_zalgo',
+        lambda: [strip_zalgo(strip_zerowidth(x)) for x in texts],
+    )
+    bench('sanitize', lambda: [sanitize(x) for x in texts])
+    bench('sanitize_many', lambda: sanitize_many(texts))
+    cached = Sanitizer(cache_size=4096)
+    repeated = texts[:500] * 20  # spam repeats itself
+    bench('sanitize_many, repeated text', lambda: sanitize_many(repeated))
+    bench(
+        'Sanitizer.many, repeated text, cached', lambda: cached.many(repeated)
+    )
+
+
+if __name__ == '__main__':
+    main()
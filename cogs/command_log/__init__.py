@@ -2,4 +2,4 @@ from .command_log import CommandLog
 
 
 def setup(heleus):
-    heleus.add_cog(CommandLog())
+    heleus.add_cog(CommandLog(heleus))
@@ -1,27 +1,378 @@
+import asyncio
+import collections
+import datetime
+import json
 import logging
+import random
+import re
+import time
+
+from coredis import PureToken
 from disnake import abc
-from disnake.ext import commands
+from disnake.ext import commands, tasks
+
+from utils import checks
+from utils.histogram import LatencyHistogram
+from utils.lazy import lazy_import
+
+# only needed by the owner commands
+tabulate = lazy_import('tabulate')
+
+# command latency histograms are kept in Redis hashes of bucket -> count,
+# one per command and kind, so that every shard's counts add up
+LATENCY_KEY = 'command_latency'
+LATENCY_KINDS = ('prefix', 'slash', 'user', 'message')
+# commands are audited into a Redis stream shared by every shard, trimmed to
+# roughly this many entries, with per-command sampling rates in a hash
+AUDIT_KEY = 'command_audit'
+AUDIT_SAMPLING_KEY = 'command_audit:sampling'
+AUDIT_MAXLEN = 100_000
+AUDIT_BUFFER = 10_000  # unflushed entries kept if Redis can't keep up
+
+_durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_duration_re = re.compile(r'^(\d+)([smhdw])$')
+
+
+def _parse_time(value) -> int:
+    """Parses 30m, 2d etc. as that long ago, or an ISO date, into ms."""
+    match = _duration_re.match(value)
+    if match:
+        seconds = int(match.group(1)) * _durations[match.group(2)]
+        return int((time.time() - seconds) * 1000)
+    when = datetime.datetime.fromisoformat(value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return int(when.timestamp() * 1000)
+
+
+def _compact(value):
+    """Reduces a command argument to something JSON can store."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, 'id'):
+        return value.id
+    return str(value)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
 
 
 class CommandLog(commands.Cog):
-    """A simple cog to log commands executed."""
+    """A simple cog to log commands executed, and how long they took."""
 
-    def __init__(self):
+    def __init__(self, heleus):
+        self.heleus = heleus
         self.log = logging.getLogger('heleus.command_log')
+        self._latency = {}  # (kind, command) -> LatencyHistogram, unflushed
+        self._audit = collections.deque(maxlen=AUDIT_BUFFER)  # unflushed
+        self._sampling = {}  # command -> share of invocations audited
+        self._flush_latency.start()
+        self._flush_audit.start()
+
+    def cog_unload(self):
+        self._flush_latency.cancel()
+        self._flush_audit.cancel()
+        self.heleus.loop.create_task(self.flush_latency())
+        self.heleus.loop.create_task(self.flush_audit())
+
+    @commands.Cog.listener()
+    async def on_command_timed(self, kind, name, duration, _):
+        histogram = self._latency.get((kind, name))
+        if histogram is None:
+            histogram = self._latency[(kind, name)] = LatencyHistogram()
+        histogram.record(duration)
+
+    async def flush_latency(self):
+        """Adds the latencies recorded since the last flush to Redis."""
+        pending, self._latency = self._latency, {}
+        if not pending:
+            return
+        try:
+            # a transaction, so that a retry can't count anything twice
+            pipe = await self.heleus.redis.pipeline(transaction=True)
+            for (kind, name), histogram in pending.items():
+                key = f'{LATENCY_KEY}:{kind}:{name}'
+                await pipe.sadd(f'{LATENCY_KEY}:{kind}', [name])
+                for index, count in histogram.counts.items():
+                    await pipe.hincrby(key, str(index), count)
+            await pipe.execute()
+        except Exception:
+            # keep them for the next flush
+            for key, histogram in pending.items():
+                current = self._latency.get(key)
+                if current is None:
+                    self._latency[key] = histogram
+                else:
+                    current.merge(histogram)
+            raise
+
+    @tasks.loop(seconds=30)
+    async def _flush_latency(self):
+        try:
+            await self.flush_latency()
+        except Exception:
+            self.log.exception('Unable to flush command latencies to Redis.')
+
+    async def get_latency(self, kind) -> dict:
+        """Fetches the merged latency histograms of every command of a kind."""
+        redis = self.heleus.redis
+        names = [
+            x.decode() if isinstance(x, bytes) else x
+            for x in await redis.smembers(f'{LATENCY_KEY}:{kind}')
+        ]
+        counts = await asyncio.gather(
+            *[redis.hgetall(f'{LATENCY_KEY}:{kind}:{x}') for x in names]
+        )
+        return {
+            name: LatencyHistogram(count) for name, count in zip(names, counts)
+        }
 
     @commands.Cog.listener()
     async def on_command(self, ctx):
-        kwargs = ', '.join([f'{k}={repr(v)}' for k, v in ctx.kwargs.items()])
-        args = f'with arguments {kwargs} ' if kwargs else ''
-        if ctx.guild:
-            msg = (
-                f'{ctx.author} ({ctx.author.id}) executed command "{ctx.command}" {args}in {ctx.guild} '
-                f'({ctx.guild.id})'
+        name = ctx.command.qualified_name
+        rate = self._sampling.get(name, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if self.log.isEnabledFor(logging.DEBUG):
+            kwargs = ', '.join(f'{k}={v!r}' for k, v in ctx.kwargs.items())
+            args = f'with arguments {kwargs} ' if kwargs else ''
+            if ctx.guild:
+                where = f'in {ctx.guild} ({ctx.guild.id})'
+            elif isinstance(ctx.channel, abc.PrivateChannel):
+                where = 'in DMs'
+            else:
+                where = 'in a guild'
+            if ctx.bot.shard_id is not None:
+                where += f' on shard {ctx.bot.shard_id + 1}'
+            self.log.debug(
+                f'{ctx.author} ({ctx.author.id}) executed command '
+                f'"{ctx.command}" {args}{where}'
+            )
+        # kept as raw values, they're only formatted when read
+        self._audit.append(
+            (
+                int(time.time() * 1000),
+                ctx.author.id,
+                ctx.guild.id if ctx.guild else 0,
+                ctx.channel.id,
+                ctx.bot.shard_id,
+                name,
+                ctx.kwargs,
+                rate,
             )
-        elif isinstance(ctx.channel, abc.PrivateChannel):
-            msg = f'{ctx.author} ({ctx.author.id}) executed command "{ctx.command}" {args}in DMs'
+        )
+
+    async def flush_audit(self):
+        """Writes the audit entries recorded since the last flush to Redis."""
+        pending = list(self._audit)
+        self._audit.clear()
+        if not pending:
+            return
+        pipe = await self.heleus.redis.pipeline(transaction=True)
+        for when, user, guild, channel, shard, name, kwargs, rate in pending:
+            fields = {
+                't': when,
+                'u': user,
+                'g': guild,
+                'c': channel,
+                'n': name,
+                'a': json.dumps({k: _compact(v) for k, v in kwargs.items()}),
+            }
+            if shard is not None:
+                fields['s'] = shard
+            if rate < 1.0:
+                fields['r'] = rate
+            await pipe.xadd(
+                AUDIT_KEY,
+                fields,
+                trim_strategy=PureToken.MAXLEN,
+                threshold=AUDIT_MAXLEN,
+                trim_operator=PureToken.APPROXIMATELY,
+            )
+        try:
+            await pipe.execute()
+        except Exception:
+            # requeue them ahead of newer entries, dropping the oldest if
+            # that overflows the buffer
+            self._audit = collections.deque(
+                pending + list(self._audit), maxlen=AUDIT_BUFFER
+            )
+            raise
+
+    @tasks.loop(seconds=5)
+    async def _flush_audit(self):
+        try:
+            await self.flush_audit()
+            sampling = await self.heleus.redis.hgetall(AUDIT_SAMPLING_KEY)
+        except Exception:
+            self.log.exception('Unable to flush the command audit to Redis.')
+            return
+        self._sampling = {_decode(k): float(v) for k, v in sampling.items()}
+
+    async def query_audit(
+        self,
+        user=None,
+        guild=None,
+        command=None,
+        since=None,
+        until=None,
+        limit=20,
+        scan=10_000,
+    ) -> list:
+        """Finds the newest audit entries matching some filters.
+
+        Times are in milliseconds. At most `scan` entries are read, newest
+        first, as the stream is only indexed by time.
+        """
+        redis = self.heleus.redis
+        # entry IDs are the time they were flushed, shortly after they ran
+        end = '+' if until is None else str(until + 10_000)
+        start = '-' if since is None else str(since)
+        results = []
+        scanned = 0
+        while len(results) < limit and scanned < scan:
+            entries = await redis.xrevrange(AUDIT_KEY, end, start, count=500)
+            if not entries:
+                break
+            for entry in entries:
+                fields = {
+                    _decode(k): _decode(v)
+                    for k, v in entry.field_values.items()
+                }
+                if until is not None and int(fields['t']) > until:
+                    continue
+                if since is not None and int(fields['t']) < since:
+                    continue
+                if user is not None and int(fields['u']) != user:
+                    continue
+                if guild is not None and int(fields['g']) != guild:
+                    continue
+                if command is not None and fields['n'] != command:
+                    continue
+                results.append(fields)
+                if len(results) >= limit:
+                    break
+            scanned += len(entries)
+            end = f'({_decode(entries[-1].identifier)}'
+        return results
+
+    @commands.group(invoke_without_command=True)
+    @checks.is_owner()
+    async def audit(self, ctx, *filters):
+        """Searches the commands run on every shard, newest first.
+
+        * filters: Any of user=, guild=, command=, since=, until= and
+          limit=, with times such as 30m, 2d or 2023-01-31. Quote filters
+          containing spaces, such as "command=stats cache"
+
+        Arguments marked with * are optional.
+        """
+        query = {}
+        try:
+            for item in filters:
+                key, _, value = item.partition('=')
+                if key in ('user', 'guild'):
+                    query[key] = int(value.strip('<@!&#>'))
+                elif key == 'command':
+                    query[key] = value
+                elif key in ('since', 'until'):
+                    query[key] = _parse_time(value)
+                elif key == 'limit':
+                    query[key] = min(int(value), 100)
+                else:
+                    raise ValueError(key)
+        except ValueError:
+            await ctx.send('Invalid filter.')
+            return await self.heleus.send_command_help(ctx)
+        await self.flush_audit()
+        entries = await self.query_audit(**query)
+        if not entries:
+            return await ctx.send('No matching commands were found.')
+        rows = []
+        for entry in entries:
+            user = self.heleus.get_user(int(entry['u']))
+            args = ' '.join(
+                f'{k}={v}' for k, v in json.loads(entry['a']).items()
+            )
+            rows.append(
+                [
+                    datetime.datetime.fromtimestamp(
+                        int(entry['t']) / 1000, datetime.timezone.utc
+                    ).strftime('%Y-%m-%d %H:%M:%S'),
+                    str(user) if user else entry['u'],
+                    entry['g'] if entry['g'] != '0' else 'DMs',
+                    int(entry['s']) + 1 if 's' in entry else '',
+                    entry['n'],
+                    args[:40],
+                ]
+            )
+        headers = ['When (UTC)', 'User', 'Guild', 'Shard', 'Command', 'Args']
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        await ctx.send(f'```prolog\n{table[:1980]}\n```')
+
+    @audit.command()
+    @checks.is_owner()
+    async def sample(self, ctx, rate: float, *, command: str):
+        """Audits only a share of a command's invocations, for hot commands.
+
+        - rate: The share to audit, from 0 to 1 (1 audits every invocation)
+        - command: The command's full name, e.g. stats cache
+        """
+        if not 0 <= rate <= 1:
+            return await ctx.send('The rate must be between 0 and 1.')
+        if rate == 1:
+            await self.heleus.redis.hdel(AUDIT_SAMPLING_KEY, [command])
+            self._sampling.pop(command, None)
         else:
-            msg = f'{ctx.author} ({ctx.author.id}) executed command "{ctx.command}" {args}in a guild'
-        if ctx.bot.shard_id is not None:
-            msg += f' on shard {ctx.bot.shard_id+1}'
-        self.log.info(msg)
+            await self.heleus.redis.hset(AUDIT_SAMPLING_KEY, {command: rate})
+            self._sampling[command] = rate
+        await ctx.send(f'Auditing {rate:.0%} of `{command}` invocations.')
+
+    @commands.group(invoke_without_command=True)
+    @checks.is_owner()
+    async def latency(self, ctx, kind='prefix'):
+        """Shows command latency percentiles across all shards.
+
+        * kind: "prefix", "slash", "user" or "message"
+
+        Arguments marked with * are optional.
+        """
+        if kind not in LATENCY_KINDS:
+            await ctx.send('Invalid kind.')
+            return await self.heleus.send_command_help(ctx)
+        await self.flush_latency()
+        histograms = await self.get_latency(kind)
+        if not histograms:
+            return await ctx.send('No latencies have been recorded yet.')
+        rows = [
+            [
+                name,
+                len(histogram),
+                *[
+                    f'{histogram.percentile(x) * 1000:.1f}'
+                    for x in (50, 95, 99)
+                ],
+            ]
+            for name, histogram in sorted(
+                histograms.items(), key=lambda x: -x[1].percentile(95)
+            )
+        ]
+        headers = ['Command', 'Calls', 'p50 ms', 'p95 ms', 'p99 ms']
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        await ctx.send(f'```prolog\n{table[:1980]}\n```')
+
+    @latency.command()
+    @checks.is_owner()
+    async def reset(self, ctx):
+        """Clears the recorded command latencies, e.g. after a deploy."""
+        redis = self.heleus.redis
+        self._latency = {}
+        for kind in LATENCY_KINDS:
+            names = await redis.smembers(f'{LATENCY_KEY}:{kind}')
+            keys = [f'{LATENCY_KEY}:{kind}']
+            for name in names:
+                name = name.decode() if isinstance(name, bytes) else name
+                keys.append(f'{LATENCY_KEY}:{kind}:{name}')
+            await redis.delete(keys)
+        await ctx.send('Command latencies cleared.')
@@ -1,25 +1,73 @@
+import asyncio
 import datetime
-import inspect
 import textwrap
 import time
 import traceback
 import os
 import pkgutil
 import io
+import json
 
 import aiohttp
 import disnake as discord
 from disnake.ext import commands, tasks
 
-from utils import checks
+from utils import checks, yaml
+from utils.admission import AdmissionController
+from utils.boot import BOOT_KEY, format_profile
+from utils.errors import ErrorTracker
+from utils.extensions import LazyCogs, load_order, requirements
+from utils.lazy import lazy_import
+from utils.memory import cache_stats, format_size
+from utils.metrics import Counter, Histogram, get_or_create
+from utils.preconditions import PreconditionList, PreconditionPipeline
+from utils.prefilter import MessagePrefilter
+from utils.profiler import MODES, start_profiling, stop_profiling
 from utils.runtime import CoreMode
 from utils.storage import RedisCollection
+from utils.task_tracker import snapshot_tasks
+from utils.watcher import CogWatcher
+
+# only needed by the stats commands
+tabulate = lazy_import('tabulate')
 
 
 def reload_core(heleus):
     heleus.loop.create_task(heleus.get_cog('Core').reload_self())
 
 
+def reload_extensions(heleus, names):
+    heleus.loop.call_soon_threadsafe(
+        heleus.loop.create_task,
+        heleus.get_cog('Core').reload_changed(names),
+    )
+
+
+def lag_report(heleus):
+    monitor = heleus.lag_monitor
+    return {
+        'lag': monitor.lag,
+        'average': monitor.average,
+        'max_lag': monitor.max_lag,
+        'count': heleus.slow_callbacks.count,
+        'worst': [x.to_dict() for x in heleus.slow_callbacks.worst],
+    }
+
+
+ASYNC_SETUP_TIMEOUT = 30  # seconds an extension's async_setup may take
+
+
+def instance_id(heleus):
+    return heleus.instance_id
+
+
+_application_kinds = {
+    discord.ApplicationCommandType.chat_input: 'slash',
+    discord.ApplicationCommandType.user: 'user',
+    discord.ApplicationCommandType.message: 'message',
+}
+
+
 class Core(commands.Cog):
     def __init__(self, heleus):
         self.heleus = heleus
@@ -31,11 +79,69 @@ class Core(commands.Cog):
         self.settings = RedisCollection(self.heleus.redis, 'settings')
         self.logger = self.heleus.logger
         self._post.start()
-        self.global_preconditions = []  # preconditions to message processing
-        self.global_preconditions_overrides = (
-            []
-        )  # overrides to the preconditions
+        # rejects messages that can't be commands before anything is awaited
+        self.prefilter = MessagePrefilter(self.heleus)
+        # sheds command processing during message bursts and loop lag
+        self.admission = AdmissionController(
+            self.heleus,
+            self.heleus.lag_monitor,
+            self.prefilter,
+            max_per_guild=self.heleus.guild_concurrency,
+            lag_threshold=self.heleus.shed_lag,
+        )
+        # preconditions to message processing, and overrides to them
+        self.global_preconditions = PreconditionList()
+        self.global_preconditions_overrides = PreconditionList()
+        # new preconditions should be registered here rather than appended
+        # to the lists above, see utils.preconditions
+        self.preconditions = PreconditionPipeline(
+            self.global_preconditions, self.global_preconditions_overrides
+        )
         self._eval = {}
+        self.async_setup_times = {}  # extension -> seconds
+        self.load_failures = {}  # extension -> why it couldn't be loaded
+        # watches cog source on the main shard when --watch_cogs is set
+        self.watcher = None
+        # cogs in config/cogs.yml are stubbed, and loaded when first used
+        self.lazy = LazyCogs(self.heleus, self._load_lazy)
+        # groups command errors, so repeats of one are logged once a minute
+        self.errors = ErrorTracker()
+        self._command_started = {}  # command invocation -> perf_counter
+        self._commands_total = get_or_create(
+            Counter,
+            'heleus_commands',
+            'Commands invoked, by type, command and outcome.',
+            labels=('kind', 'command', 'outcome'),
+        )
+        self._command_duration = get_or_create(
+            Histogram,
+            'heleus_command_duration_seconds',
+            'Time taken to run commands.',
+            labels=('kind', 'command'),
+        )
+        get_or_create(
+            Counter,
+            'heleus_prefiltered_messages',
+            'Messages checked by the prefilter, by result.',
+            labels=('result',),
+        ).callback = lambda: [
+            (('filtered',), self.prefilter.filtered),
+            (('processed',), self.prefilter.processed),
+        ]
+        get_or_create(
+            Counter,
+            'heleus_shed_messages',
+            'Messages shed by the admission controller, by reason.',
+            labels=('reason',),
+        ).callback = lambda: [
+            ((k,), v) for k, v in self.admission.shed.items()
+        ]
+        get_or_create(
+            Counter,
+            'heleus_command_errors',
+            'Command errors, by command and exception type.',
+            labels=('command', 'type'),
+        ).callback = lambda: list(self.errors.totals.items())
         self.haste_url = os.environ.get(
             'HELEUS_HASTE_URL', 'https://hastebin.com'
         )
@@ -53,10 +159,6 @@ class Core(commands.Cog):
                 continue
             obj.help = obj.help.format(self.heleus.name)
 
-    def __unload(self):
-        self._maintenance_loop.cancel()
-        self._owner_checks.cancel()
-
     @staticmethod
     def fetch_submodules(module):
         # Somewhat hacky but OH WELL
@@ -81,18 +183,31 @@ class Core(commands.Cog):
                         edited = True
             self.cogs_ready = True
 
-        for cog in cogs:
-            if cog not in list(self.heleus.extensions):
-                # noinspection PyBroadException
-                try:
-                    await self.load_cog(cog)
-                except Exception:
-                    cogs.remove(cog)
-                    edited = True
-                    self.logger.warning(
-                        f'{repr(cog)} could not be loaded. This message will not be shown again. '
-                        f'Full traceback:\n{traceback.format_exc()}'
-                    )
+        to_load = [x for x in cogs if x not in self.heleus.extensions]
+        # cogs required by ones being loaded now can't wait to be used
+        needed = set()
+        pending = [x for x in to_load if x not in self.lazy]
+        while pending:
+            for dependency in requirements(pending.pop()):
+                if dependency in self.lazy and dependency not in needed:
+                    needed.add(dependency)
+                    pending.append(dependency)
+        for name in to_load:
+            if name in self.lazy and name not in needed:
+                self.lazy.stub(name)
+        for name in needed:
+            # stubbed before a cog requiring it was added, load it for real
+            self.lazy.unstub(name)
+        to_load = [x for x in to_load if x not in self.lazy.stubs]
+        if to_load:
+            failed = await self.load_cogs(to_load)
+            for cog, reason in failed.items():
+                cogs.remove(cog)
+                edited = True
+                self.logger.warning(
+                    f'{repr(cog)} could not be loaded. This message will not be shown again. '
+                    f'{reason}'
+                )
         if edited:
             await self.settings.set('cogs', cogs)
 
@@ -101,6 +216,23 @@ class Core(commands.Cog):
                 continue
             if cog not in cogs:
                 self.heleus.unload_extension(cog)
+        for cog in list(self.lazy.stubs):
+            if cog not in cogs:
+                self.lazy.unstub(cog)
+        if self.watcher is not None:
+            self.watcher.watch(self.heleus.extensions)
+
+    def cog_unload(self):
+        # the old core would otherwise keep loading and stubbing cogs
+        self._post.cancel()
+        self._maintenance_loop.cancel()
+        self._owner_checks.cancel()
+        self._error_summaries.cancel()
+        if self.watcher is not None:
+            self.watcher.stop()
+        # a reloaded core stubs the cogs again
+        for name in list(self.lazy.stubs):
+            self.lazy.unstub(name)
 
     @tasks.loop(count=1)
     async def _post(self):
@@ -113,7 +245,18 @@ class Core(commands.Cog):
         )
 
         # Load cogs
-        await self._cog_loop()
+        with self.heleus.boot.phase('cogs'):
+            await self._cog_loop()
+
+        # parse the documents cogs registered, so commands don't have to
+        with self.heleus.boot.phase('config'):
+            yaml.preload()
+
+        # one shard watches for changes and tells every shard to reload
+        if self.heleus.watch_cogs and not self.heleus.shard_id:
+            self.watcher = CogWatcher(self.heleus.loop, self._source_changed)
+            self.watcher.watch(self.heleus.extensions)
+            self.watcher.start()
 
         # Mess with the instance's mode
         instance = await self.settings.get(
@@ -133,6 +276,16 @@ class Core(commands.Cog):
         # start the loops
         self._maintenance_loop.start()
         self._owner_checks.start()
+        self._error_summaries.start()
+
+    @tasks.loop(seconds=60)
+    async def _error_summaries(self):
+        for record, suppressed in self.errors.flush():
+            self.logger.warning(
+                f'The exception in the command {record.command}, error '
+                f'{record.id}, occurred {suppressed} more times since it was '
+                f'last logged ({record.count} times in total).'
+            )
 
     @tasks.loop(seconds=15)
     async def _owner_checks(self):
@@ -179,10 +332,208 @@ class Core(commands.Cog):
             )
         )
 
+    def _log_command_error(self, ctx, record, suppressed, exception):
+        """Logs a command error the error tracker decided to report."""
+        if isinstance(ctx, commands.Context):
+            command = ctx.command
+            command_detail = {
+                'name': command.name,
+                'qualified_name': command.qualified_name,
+                'hidden': command.hidden,
+                'description': command.description,
+                'aliases': command.aliases,
+            }
+        else:
+            command = ctx.application_command
+            description = None
+            match command.body:
+                case discord.SlashCommand():
+                    command_type = 'SlashCommand'
+                    description = command.body.description
+                case discord.MessageCommand():
+                    command_type = 'MessageCommand'
+                case discord.UserCommand():
+                    command_type = 'UserCommand'
+                case unknown:
+                    command_type = f'Unknown ({unknown})'
+            command_detail = {
+                'name': command.name,
+                'qualified_name': command.qualified_name,
+                'type': command_type,
+                'hidden': False,
+                'description': description,
+                'aliases': None,
+            }
+        detail = {
+            'guild_id': ctx.guild.id if ctx.guild else None,
+            'user_id': ctx.author.id,
+            'channel_id': ctx.channel.id,
+            'command': command_detail,
+            'exception': {
+                'type': record.type,
+                'fingerprint': record.id,
+                'count': record.count,
+                'suppressed': suppressed,
+                'traceback': record.traceback,
+            },
+        }
+        if isinstance(ctx, commands.Context):
+            detail['message'] = {
+                'id': ctx.message.id,
+                'content': ctx.message.clean_content,
+            }
+        repeats = ''
+        if record.count > 1:
+            repeats = (
+                f' ({record.count} times, {suppressed} not logged since the '
+                'last report)'
+            )
+        reporter = self.heleus.error_reporter
+        if reporter is not None:
+            reporter.capture_exception(
+                exception,
+                extra=detail,
+                tags={
+                    'command': command.qualified_name,
+                    'fingerprint': record.id,
+                    'shard_id': self.heleus.shard_id,
+                },
+            )
+        self.logger.error(
+            f'An exception occurred in the command {command.qualified_name}, '
+            f'error {record.id}{repeats}:\n{record.traceback}',
+            exc_info=detail,
+            extra={'reported': reporter is not None},
+        )
+
+    async def _source_changed(self, names):
+        self.logger.info(f'Source changed for {", ".join(names)}, reloading.')
+        if self.heleus.shard_id is None:
+            await self.reload_changed(names)
+        else:
+            await self.heleus.run_on_shard('all', reload_extensions, names)
+
+    async def reload_changed(self, names):
+        """Reloads the given extensions, core last as it replaces this.
+
+        Extensions that require a changed one are reloaded after it, so
+        they don't keep using the old version. A reload that fails leaves
+        the old version loaded, and the extension stays watched.
+        """
+        names = {x for x in names if x in self.heleus.extensions}
+        others = names - {'cogs.core'}
+        # add the loaded extensions that require the changed ones
+        added = True
+        while added:
+            added = False
+            for name in self.heleus.extensions:
+                if name == 'cogs.core' or name in others:
+                    continue
+                if any(x in others for x in requirements(name)):
+                    others.add(name)
+                    added = True
+        loaded = [x for x in self.heleus.extensions if x not in others]
+        order, requires, failed = load_order(sorted(others), loaded)
+        reloaded = []
+        for name in order:
+            for dependency in requires[name]:
+                if dependency in failed:
+                    failed[name] = f'It requires {dependency}, which failed.'
+                    break
+            else:
+                # noinspection PyBroadException
+                try:
+                    self.heleus.reload_extension(name)
+                    await self._async_setup(name)
+                except Exception:
+                    failed[name] = f'Full traceback:\n{traceback.format_exc()}'
+                else:
+                    reloaded.append(name)
+        for name, reason in failed.items():
+            self.logger.error(f'Unable to reload {name}. {reason}')
+        if reloaded:
+            self.logger.info(f'Reloaded {", ".join(reloaded)}.')
+        if 'cogs.core' in names:
+            await self.reload_self()
+
     async def reload_self(self):
         self.heleus.unload_extension('cogs.core')
         await self.load_cog('cogs.core')
 
+    async def _async_setup(self, name):
+        """Runs an extension's async_setup hook, if it has one."""
+        hook = getattr(self.heleus.extensions[name], 'async_setup', None)
+        if hook is None:
+            return
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(hook(self.heleus), ASYNC_SETUP_TIMEOUT)
+        except BaseException:
+            self.heleus.unload_extension(name)
+            raise
+        finally:
+            self.async_setup_times[name] = time.perf_counter() - started
+
+    async def load_cogs(self, names):
+        """Loads several cogs, returning the ones that failed and why.
+
+        Cogs are set up after the cogs they list in their ``requires``,
+        then their async_setup hooks run concurrently, each once the hooks
+        of its requirements are done. A failing cog only fails the cogs
+        that require it.
+        """
+        order, requires, failed = load_order(names, self.heleus.extensions)
+        for name in order:
+            for dependency in requires[name]:
+                if dependency in failed:
+                    failed[
+                        name
+                    ] = f'It requires {dependency}, which failed to load.'
+                    break
+            else:
+                # noinspection PyBroadException
+                try:
+                    self.heleus.load_extension(name)
+                except Exception:
+                    failed[name] = f'Full traceback:\n{traceback.format_exc()}'
+
+        setups = {}
+
+        async def setup(name):
+            for dependency in requires[name]:
+                if dependency in setups and not await setups[dependency]:
+                    failed[
+                        name
+                    ] = f'It requires {dependency}, which failed to load.'
+                    self.heleus.unload_extension(name)
+                    return False
+            # noinspection PyBroadException
+            try:
+                await self._async_setup(name)
+            except Exception:
+                failed[name] = (
+                    'Its async_setup failed, full traceback:\n'
+                    f'{traceback.format_exc()}'
+                )
+                return False
+            return True
+
+        for name in order:
+            if name not in failed:
+                setups[name] = asyncio.ensure_future(setup(name))
+        await asyncio.gather(*setups.values())
+        self.load_failures.update(failed)
+        return failed
+
+    async def _load_lazy(self, name):
+        """Loads a stubbed cog, and any stubbed cogs it requires."""
+        for dependency in requirements(name):
+            if dependency in self.lazy.stubs:
+                await self.lazy.resolve(dependency)
+        failed = await self.load_cogs([name])
+        if name in failed:
+            raise commands.ExtensionError(failed[name], name=name)
+
     # make IDEA stop acting like a baby
     # noinspection PyShadowingBuiltins
     async def load_cog(self, name):
@@ -191,7 +542,28 @@ class Core(commands.Cog):
         if name in self.heleus.extensions:
             return
 
-        self.heleus.load_extension(name)
+        for dependency in requirements(name):
+            if dependency in self.lazy.stubs:
+                await self.lazy.resolve(dependency)
+        missing = [
+            x for x in requirements(name) if x not in self.heleus.extensions
+        ]
+        if missing:
+            raise commands.ExtensionError(
+                f'{name} requires {", ".join(missing)}, load those first.',
+                name=name,
+            )
+        # the stubs would clash with the real commands and listeners
+        stubbed = name in self.lazy.stubs
+        self.lazy.unstub(name)
+        try:
+            self.heleus.load_extension(name)
+            await self._async_setup(name)
+        except Exception:
+            if stubbed:
+                self.lazy.stub(name)
+            raise
+        self.load_failures.pop(name, None)
 
         cogs = await self.settings.get('cogs', [])
         if name not in cogs:
@@ -203,6 +575,17 @@ class Core(commands.Cog):
     # noinspection PyArgumentList
     @commands.Cog.listener()
     async def on_message(self, message):
+        if not self.prefilter.check(message):
+            return
+        slot = await self.admission.admit(message)
+        if slot is None:
+            return
+        try:
+            await self._process_message(message)
+        finally:
+            self.admission.release(message, slot)
+
+    async def _process_message(self, message):
         instance = await self.settings.get(self.heleus.instance_id, {})
         mode = instance.get('mode', CoreMode.down)
         if mode in (CoreMode.down, CoreMode.boot):
@@ -210,44 +593,80 @@ class Core(commands.Cog):
         if (
             message.author.id in self.heleus.owners
         ):  # *always* process owner commands
-            await self.heleus.process_commands(message)
+            await self._process_commands(message)
             return
         if mode == CoreMode.maintenance:
             return
-        # Overrides start here (yay)
-        for override in self.global_preconditions_overrides:
-            # noinspection PyBroadException
-            try:
-                out = override(message)
-                if inspect.isawaitable(out):
-                    out = await out
-                if out is True:
-                    await self.heleus.process_commands(message)
-                    return
-            except Exception:
-                self.logger.exception(
-                    f'Removed precondition override "{override.__name__}", it was malfunctioning.'
-                )
-                self.global_preconditions_overrides.remove(override)
-        # Preconditions
-        for precondition in self.global_preconditions:
-            # noinspection PyBroadException
-            try:
-                out = precondition(message)
-                if inspect.isawaitable(out):
-                    out = await out
-                if out is False:
-                    return
-            except Exception:
-                self.logger.exception(
-                    f'Removed precondition "{precondition.__name__}", it was malfunctioning.'
-                )
-                self.global_preconditions.remove(precondition)
+        if await self.preconditions.run(message):
+            await self._process_commands(message)
+
+    async def _process_commands(self, message):
+        if message.author.bot:
+            return
+        ctx = await self.heleus.get_context(message)
+        # a stubbed cog is loaded before invoking, so that only the real
+        # command is invoked and dispatches on_command
+        ctx = await self.lazy.prepare(ctx)
+        await self.heleus.invoke(ctx)
+
+    def _command_finished(self, kind, key, name, outcome):
+        started = self._command_started.pop(key, None)
+        self._commands_total.inc(kind, name, outcome)
+        if started is not None:
+            duration = time.perf_counter() - started
+            self._command_duration.observe(duration, kind, name)
+            # lets cogs such as command_log keep their own latency records
+            self.heleus.dispatch(
+                'command_timed', kind, name, duration, outcome
+            )
 
-        await self.heleus.process_commands(message)
+    @staticmethod
+    def _application_kind(inter):
+        return _application_kinds.get(inter.data.type, 'application')
+
+    @commands.Cog.listener()
+    async def on_command(self, ctx):
+        self._command_started[id(ctx)] = time.perf_counter()
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        self._command_finished(
+            'prefix', id(ctx), ctx.command.qualified_name, 'success'
+        )
+
+    @commands.Cog.listener()
+    async def on_application_command(self, inter):
+        self._command_started[inter.id] = time.perf_counter()
+
+    @commands.Cog.listener('on_slash_command_completion')
+    @commands.Cog.listener('on_user_command_completion')
+    @commands.Cog.listener('on_message_command_completion')
+    async def on_application_command_completion(self, inter):
+        self._command_finished(
+            self._application_kind(inter),
+            inter.id,
+            inter.application_command.qualified_name,
+            'success',
+        )
+
+    @commands.Cog.listener('on_user_command_error')
+    @commands.Cog.listener('on_message_command_error')
+    async def on_application_command_error(self, inter, _):
+        self._command_finished(
+            self._application_kind(inter),
+            inter.id,
+            inter.application_command.qualified_name,
+            'error',
+        )
 
     @commands.Cog.listener()
     async def on_slash_command_error(self, inter, exception):
+        self._command_finished(
+            self._application_kind(inter),
+            inter.id,
+            inter.application_command.qualified_name,
+            'error',
+        )
         # TODO: Ignore if command already has its own error handler
         response = None
         attachment = None
@@ -263,57 +682,38 @@ class Core(commands.Cog):
                         response = "I don't have permission to perform the action you requested."
                         ephemeral = False
                     else:
-                        error = (
-                            f'`{type(exception).__name__}` in command `{inter.application_command.qualified_name}`: '
-                            f'```py\n{self.get_traceback(exception)}\n```'
+                        name = inter.application_command.qualified_name
+                        record, suppressed = self.errors.record(
+                            name, exception
                         )
-                        if inter.guild:
-                            guild_id = inter.guild.id
-                        else:
-                            guild_id = None
-
-                        description = None
-                        match inter.application_command.body:
-                            case discord.SlashCommand():
-                                command_type = 'SlashCommand'
-                                description = (
-                                    inter.application_command.body.description
+                        if suppressed is not None:
+                            self._log_command_error(
+                                inter, record, suppressed, exception
+                            )
+                        if (
+                            checks.owner_check(inter)
+                            and suppressed is not None
+                        ):
+                            error = (
+                                f'`{record.type}` in command `{name}`: '
+                                f'```py\n{record.traceback}\n```'
+                            )
+                            if len(error) > 2000:
+                                response = (
+                                    f'`{record.type}` in command `{name}`'
                                 )
-                            case discord.MessageCommand():
-                                command_type = 'MessageCommand'
-                            case discord.UserCommand():
-                                command_type = 'UserCommand'
-                            case unknown:
-                                command_type = f'Unknown ({unknown})'
-
-                        detail = {
-                            'guild_id': guild_id,
-                            'user_id': inter.author.id,
-                            'channel_id': inter.channel.id,
-                            'command': {
-                                'name': inter.application_command.name,
-                                'qualified_name': inter.application_command.qualified_name,
-                                'type': command_type,
-                                'hidden': False,
-                                'description': description,
-                                'aliases': None,
-                            },
-                            'exception': {
-                                'type': type(exception).__name__,
-                                'traceback': self.get_traceback(exception),
-                            },
-                        }
-                        self.logger.error(
-                            f'An exception occurred in the command {inter.application_command.qualified_name}:'
-                            f'\n{self.get_traceback(exception)}',
-                            exc_info=detail,
-                        )
-                        if checks.owner_check(inter):
-                            if len(error) > 2048:
-                                response = f'`{type(exception).__name__}` in command `{inter.application_command.qualified_name}`'
-                                attachment = self.get_traceback(exception)
-                            response = error
-                        else:
+                                attachment = record.traceback
+                            else:
+                                response = error
+                        elif checks.owner_check(inter):
+                            response = (
+                                f'`{record.type}` in command `{name}`, '
+                                f'error `{record.id}` has occurred '
+                                f'{record.count} times.'
+                            )
+                        elif self.errors.should_reply(
+                            record, inter.channel_id
+                        ):
                             response = (
                                 'An error occured while running that command.'
                             )
@@ -339,6 +739,10 @@ class Core(commands.Cog):
 
     @commands.Cog.listener()
     async def on_command_error(self, context, exception):
+        if context.command is not None:
+            self._command_finished(
+                'prefix', id(context), context.command.qualified_name, 'error'
+            )
         try:
             if isinstance(exception, commands.CommandInvokeError):
                 exception = exception.original
@@ -351,44 +755,20 @@ class Core(commands.Cog):
                     else:
                         return  # don't care, don't log
 
-                error = (
-                    f'`{type(exception).__name__}` in command `{context.command.qualified_name}`: '
-                    f'```py\n{self.get_traceback(exception)}\n```'
-                )
-
-                if context.guild:
-                    guild_id = context.guild.id
-                else:
-                    guild_id = None
-
-                detail = {
-                    'guild_id': guild_id,
-                    'user_id': context.author.id,
-                    'channel_id': context.channel.id,
-                    'command': {
-                        'name': context.command.name,
-                        'qualified_name': context.command.qualified_name,
-                        'hidden': context.command.hidden,
-                        'description': context.command.description,
-                        'aliases': context.command.aliases,
-                    },
-                    'message': {
-                        'id': context.message.id,
-                        'content': context.message.clean_content,
-                    },
-                    'exception': {
-                        'type': type(exception).__name__,
-                        'traceback': self.get_traceback(exception),
-                    },
-                }
-                self.logger.error(
-                    f'An exception occurred in the command {context.command.qualified_name}:'
-                    f'\n{self.get_traceback(exception)}',
-                    exc_info=detail,
-                )
-                if self.informative_errors:
-                    if self.verbose_errors:
-                        await context.send(error)
+                name = context.command.qualified_name
+                record, suppressed = self.errors.record(name, exception)
+                if suppressed is not None:
+                    self._log_command_error(
+                        context, record, suppressed, exception
+                    )
+                if self.informative_errors and self.errors.should_reply(
+                    record, context.channel.id
+                ):
+                    if self.verbose_errors and suppressed is not None:
+                        await context.send(
+                            f'`{record.type}` in command `{name}`: '
+                            f'```py\n{record.traceback[:1900]}\n```'
+                        )
                     else:
                         await context.send(
                             'An error occurred while running that command.'
@@ -530,7 +910,13 @@ class Core(commands.Cog):
                 'If you want to install a custom loader, look into the documentation.'
             )
             return
-        if name in list(self.heleus.extensions):
+        if name in self.lazy.stubs:
+            self.lazy.unstub(name)
+            cogs = await self.settings.get('cogs')
+            cogs.remove(name)
+            await self.settings.set('cogs', cogs)
+            await ctx.send(f'`{name}` was never used, its stubs are removed.')
+        elif name in list(self.heleus.extensions):
             self.heleus.unload_extension(name)
             cogs = await self.settings.get('cogs')
             cogs.remove(name)
@@ -565,6 +951,447 @@ class Core(commands.Cog):
         else:
             await ctx.send("Unable to reload, that cog isn't loaded.")
 
+    async def _run_profiler(self, shard, func, *args):
+        if self.heleus.shard_id is None:
+            # RPCs run off the event loop, so do the same locally
+            return await self.heleus.loop.run_in_executor(
+                None, func, self.heleus, *args
+            )
+        return await self.heleus.run_on_shard(shard - 1, func, *args)
+
+    @commands.command()
+    @checks.is_owner()
+    async def profile(
+        self, ctx, shard: int, seconds: float, mode: str = 'sample'
+    ):
+        """Profiles a shard's event loop for a number of seconds.
+
+        - shard: The shard to profile
+        - seconds: How long to profile for, up to 300
+        * mode: sample, for collapsed stacks, or cprofile, for pstats
+
+        Arguments marked with * are optional.
+        """
+        if mode not in MODES:
+            return await ctx.send(f'Mode must be one of {", ".join(MODES)}.')
+        if not 0 < seconds <= 300:
+            return await ctx.send('Profile for between 0 and 300 seconds.')
+        if self.heleus.shard_id is not None:
+            if not await self.heleus.ping_shard(shard - 1):
+                return await ctx.send('Shard not online.')
+        error = await self._run_profiler(shard, start_profiling, mode, seconds)
+        if error is not None:
+            return await ctx.send(f'Unable to start profiling: {error}')
+        msg = await ctx.send(f'Profiling for {seconds:g} seconds...')
+        await asyncio.sleep(seconds)
+        result = await self._run_profiler(shard, stop_profiling)
+        if result is None or isinstance(result, Exception):
+            return await msg.edit(content=f'Profiling failed: {result}')
+        mode, duration, samples, data = result
+        now = datetime.datetime.now(datetime.timezone.utc).strftime(
+            '%Y-%m-%d_%H-%M-%S'
+        )
+        extension = 'collapsed.txt' if mode == 'sample' else 'pstats'
+        filename = f'profile_shard{shard}_{now}.{extension}'
+        summary = f'Profiled for {duration:.1f} seconds'
+        if samples is not None:
+            summary += f', {samples} samples'
+        limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024**2
+        if len(data) > limit:
+            os.makedirs('logs/profiles', exist_ok=True)
+            path = os.path.join('logs/profiles', filename)
+            with open(path, 'wb') as f:
+                f.write(data)
+            return await msg.edit(
+                content=f'{summary}, too large to upload so saved to `{path}`.'
+            )
+        await msg.delete()
+        await ctx.send(
+            f'{summary}.', file=discord.File(io.BytesIO(data), filename)
+        )
+
+    @commands.group(invoke_without_command=True)
+    @checks.is_owner()
+    async def stats(self, ctx):
+        """Shows {}'s runtime statistics."""
+        await self.heleus.send_command_help(ctx)
+
+    @stats.command()
+    @checks.is_owner()
+    async def cache(self, ctx):
+        """Shows the object counts and estimated sizes of {}'s caches."""
+        rows = [
+            [name, count, format_size(size)]
+            for name, count, size in cache_stats(self.heleus)
+        ]
+        table = tabulate.tabulate(
+            rows, ['Cache', 'Objects', 'Estimated Size'], disable_numparse=True
+        )
+        policy = self.heleus.cache_policy
+        if policy is not None:
+            table += f'\n\n{policy!r}'
+        await ctx.send(f'```prolog\n{table}\n```')
+
+    @stats.command()
+    @checks.is_owner()
+    async def messages(self, ctx):
+        """Shows how many messages {} filtered out before command processing."""
+        prefilter = self.prefilter
+        total = prefilter.filtered + prefilter.processed
+        rows = [
+            ['filtered', prefilter.filtered],
+            ['processed', prefilter.processed],
+            ['total', total],
+        ]
+        table = tabulate.tabulate(
+            rows, ['Messages', 'Count'], disable_numparse=True
+        )
+        await ctx.send(f'```prolog\n{table}\n```')
+
+    @stats.command(name='admission')
+    @checks.is_owner()
+    async def admission_stats(self, ctx):
+        """Shows how much command processing {} has shed, and why."""
+        admission = self.admission
+        rows = [
+            ['admitted', admission.admitted],
+            ['prioritised', admission.prioritised],
+            ['in flight', admission.in_flight],
+            ['queued', admission.queued],
+        ]
+        rows += [[f'shed ({k})', v] for k, v in admission.shed.most_common()]
+        lag = admission.lag_monitor
+        rows += [
+            ['loop lag (ms)', f'{lag.lag * 1000:.1f}'],
+            ['max loop lag (ms)', f'{lag.max_lag * 1000:.1f}'],
+        ]
+        table = tabulate.tabulate(
+            rows, ['Messages', 'Count'], disable_numparse=True
+        )
+        await ctx.send(f'```prolog\n{table}\n```')
+
+    @stats.command()
+    @checks.is_owner()
+    async def lag(self, ctx, shard: int = None, stacks: bool = False):
+        """Shows {}'s event loop lag and the callbacks that blocked it most.
+
+        * shard: The shard to check, defaults to the current one
+        * stacks: Whether to attach the sampled stacks
+
+        Arguments marked with * are optional.
+        """
+        if shard is None or self.heleus.shard_id is None:
+            report = lag_report(self.heleus)
+        else:
+            if not await self.heleus.ping_shard(shard - 1):
+                return await ctx.send('Shard not online.')
+            report = await self.heleus.run_on_shard(shard - 1, lag_report)
+        message = (
+            f'Loop lag: {report["lag"] * 1000:.1f} ms '
+            f'(average {report["average"] * 1000:.1f} ms, '
+            f'max {report["max_lag"] * 1000:.1f} ms), '
+            f'{report["count"]} slow callbacks seen.'
+        )
+        if report['worst']:
+            rows = [
+                [
+                    f'{x["duration"] * 1000:.0f}',
+                    datetime.datetime.fromtimestamp(
+                        x['when'], datetime.timezone.utc
+                    ).strftime('%Y-%m-%d %H:%M:%S'),
+                    x['coroutine'] or '?',
+                    x['cog'] or '',
+                    x['task'] or '',
+                ]
+                for x in report['worst']
+            ]
+            headers = ['ms', 'When (UTC)', 'Coroutine', 'Cog', 'Task']
+            table = tabulate.tabulate(rows, headers, disable_numparse=True)
+            message += f'\n```prolog\n{table}\n```'
+        if stacks and report['worst']:
+            stack = '\n'.join(
+                f'{x["duration"] * 1000:.0f} ms in {x["coroutine"]}:\n{x["stack"]}'
+                for x in report['worst']
+            )
+            attachment = discord.File(io.StringIO(stack), 'stacks.txt')
+            return await ctx.send(message[:2000], file=attachment)
+        await ctx.send(message[:2000])
+
+    @stats.command(name='tasks')
+    @checks.is_owner()
+    async def task_stats(self, ctx, shard: str = None, stacks: bool = False):
+        """Shows the asyncio tasks pending on {}, grouped by coroutine.
+
+        * shard: The shard to inspect or "all", defaults to the current one
+        * stacks: Whether to attach the stack of each group's oldest task
+
+        Arguments marked with * are optional.
+        """
+        if shard is None or self.heleus.shard_id is None:
+            reports = {None: snapshot_tasks(self.heleus, stacks)}
+        elif shard == 'all':
+            responses = await self.heleus.run_on_shard(
+                'all', snapshot_tasks, stacks
+            )
+            reports = {
+                k + 1: v
+                for k, v in sorted(responses.items())
+                if repr(v) != '<NoResponse>'
+            }
+        else:
+            try:
+                shard = int(shard)
+            except ValueError:
+                return await ctx.send('Shard must be a number or "all".')
+            if not await self.heleus.ping_shard(shard - 1):
+                return await ctx.send('Shard not online.')
+            reports = {
+                shard: await self.heleus.run_on_shard(
+                    shard - 1, snapshot_tasks, stacks
+                )
+            }
+
+        def age(seconds):
+            return '?' if seconds is None else f'{seconds:.0f}s'
+
+        rows = []
+        stack_text = []
+        pending = futures = 0
+        for number, report in reports.items():
+            if isinstance(report, Exception):
+                rows.append([number, f'error: {report}', '', '', '', ''])
+                continue
+            futures += report['rpc_futures']
+            for x in report['tasks']:
+                pending += x['count']
+                rows.append(
+                    [
+                        number,
+                        x['name'],
+                        x['count'],
+                        age(x['oldest']),
+                        age(x['newest']),
+                        x['awaiting'],
+                    ]
+                )
+                if x['stack']:
+                    stack_text.append(f'Shard {number}, {x["name"]}:')
+                    stack_text.append(x['stack'])
+        headers = ['Shard', 'Coroutine', 'Count', 'Oldest', 'Newest', 'In']
+        if shard is None or self.heleus.shard_id is None:
+            headers = headers[1:]
+            rows = [x[1:] for x in rows]
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        message = (
+            f'{pending} tasks pending, {futures} RPCs awaiting a response.'
+        )
+        if len(table) + len(message) < 1980 and not stack_text:
+            return await ctx.send(f'{message}\n```prolog\n{table}\n```')
+        text = '\n\n'.join([table] + stack_text)
+        await ctx.send(
+            message, file=discord.File(io.StringIO(text), 'tasks.txt')
+        )
+
+    @stats.command()
+    @checks.is_owner()
+    async def boot(self, ctx, shard: int = None):
+        """Shows how long {} took to start, over its last few boots.
+
+        * shard: The shard to check, defaults to the current one
+
+        Arguments marked with * are optional.
+        """
+        instance = self.heleus.instance_id
+        if shard is not None and self.heleus.shard_id is not None:
+            if not await self.heleus.ping_shard(shard - 1):
+                return await ctx.send('Shard not online.')
+            instance = await self.heleus.run_on_shard(shard - 1, instance_id)
+        profiles = [
+            json.loads(x)
+            for x in await self.heleus.redis.lrange(
+                f'{BOOT_KEY}:{instance}', 0, -1
+            )
+        ]
+        if not profiles:
+            return await ctx.send('No boots have been recorded yet.')
+        history = tabulate.tabulate(
+            [
+                [
+                    datetime.datetime.utcfromtimestamp(x['time']).strftime(
+                        '%Y-%m-%d %H:%M:%S'
+                    ),
+                    f'{x["total"]:.2f}',
+                ]
+                for x in profiles
+            ],
+            ['Ready at (UTC)', 'Seconds'],
+            disable_numparse=True,
+        )
+        latest = format_profile(profiles[0])
+        message = f'```prolog\n{latest}\n\n{history}\n```'
+        if len(message) > 2000:
+            return await ctx.send(
+                file=discord.File(
+                    io.StringIO(f'{latest}\n\n{history}'), 'boot.txt'
+                )
+            )
+        await ctx.send(message)
+
+    @stats.command(name='cogs')
+    @checks.is_owner()
+    async def extension_stats(self, ctx):
+        """Shows how long each of {}'s cogs took to load, and which failed.
+
+        Cogs that are stubbed until first used are listed separately.
+        """
+        timings = self.heleus.cog_timings
+        rows = []
+        for name in self.heleus.extensions:
+            import_time, setup_time = timings.get(name, (0.0, 0.0))
+            async_time = self.async_setup_times.get(name)
+            rows.append(
+                [
+                    name,
+                    f'{import_time * 1000:.0f}',
+                    f'{setup_time * 1000:.0f}',
+                    '' if async_time is None else f'{async_time * 1000:.0f}',
+                    ', '.join(requirements(name)),
+                ]
+            )
+        rows.sort(key=lambda x: -sum(float(y or 0) for y in x[1:4]))
+        table = tabulate.tabulate(
+            rows,
+            ['Cog', 'Import ms', 'Setup ms', 'Async ms', 'Requires'],
+            disable_numparse=True,
+        )
+        if self.load_failures:
+            failures = tabulate.tabulate(
+                [
+                    [k, v.splitlines()[0]]
+                    for k, v in self.load_failures.items()
+                ],
+                ['Failed', 'Reason'],
+                disable_numparse=True,
+            )
+            table += f'\n\n{failures}'
+        if self.lazy.stubs:
+            stubbed = tabulate.tabulate(
+                [
+                    [k, ', '.join(c) or '-', ', '.join(e for e, _ in l) or '-']
+                    for k, (c, l) in self.lazy.stubs.items()
+                ],
+                ['Stubbed', 'Commands', 'Events'],
+                disable_numparse=True,
+            )
+            table += f'\n\n{stubbed}'
+        await ctx.send(f'```prolog\n{table[:1980]}\n```')
+
+    @stats.command(name='errors')
+    @checks.is_owner()
+    async def error_stats(self, ctx, error_id: str = None):
+        """Shows the command errors {} has seen most since it started.
+
+        * error_id: An error to show the traceback of
+
+        Arguments marked with * are optional.
+        """
+        if error_id is not None:
+            record = self.errors.get(error_id)
+            if record is None:
+                return await ctx.send('No error with that ID was found.')
+            message = (
+                f'`{record.type}` in command `{record.command}`, seen '
+                f'{record.count} times:'
+            )
+            traceback_block = f'```py\n{record.traceback}\n```'
+            if len(message) + len(traceback_block) < 2000:
+                return await ctx.send(f'{message}\n{traceback_block}')
+            attachment = discord.File(
+                io.StringIO(record.traceback), 'error.log'
+            )
+            return await ctx.send(message, file=attachment)
+        records = self.errors.top(15)
+        if not records:
+            return await ctx.send('No command errors have occurred.')
+        now = time.time()
+        rows = [
+            [
+                x.id,
+                x.count,
+                x.suppressed,
+                x.command,
+                x.type,
+                x.frame,
+                f'{now - x.last_seen:.0f}s',
+            ]
+            for x in records
+        ]
+        headers = ['ID', 'Count', 'Unlogged', 'Command', 'Type', 'At', 'Last']
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        await ctx.send(f'```prolog\n{table[:1980]}\n```')
+
+    @stats.command()
+    @checks.is_owner()
+    async def listeners(self, ctx):
+        """Shows the time {}'s event listeners took, per cog and event."""
+        profiler = self.heleus.listener_profiler
+        if profiler is None:
+            return await ctx.send(
+                'Listener accounting is disabled, start me with '
+                '`--listener_sample_rate` to enable it.'
+            )
+        entries = sorted(
+            profiler.stats.values(), key=lambda x: -x.estimated_time
+        )
+        rows = [
+            [
+                x.cog,
+                x.event,
+                x.calls,
+                x.errors,
+                f'{x.estimated_time:.2f}',
+                f'{x.time / x.sampled * 1000:.2f}' if x.sampled else '',
+            ]
+            for x in entries[:25]
+        ]
+        headers = ['Cog', 'Event', 'Calls', 'Errors', 'Total s', 'Avg ms']
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        await ctx.send(f'```prolog\n{table[:1980]}\n```')
+
+    @stats.command(name='preconditions')
+    @checks.is_owner()
+    async def precondition_stats(self, ctx):
+        """Shows the timings and counters of {}'s message preconditions."""
+        rows = []
+        for entry in self.preconditions.entries():
+            average = entry.time / entry.calls * 1000 if entry.calls else 0
+            rows.append(
+                [
+                    entry.name,
+                    'override' if entry.override else 'precondition',
+                    entry.priority,
+                    len(entry.guilds) if entry.guilds is not None else 'all',
+                    entry.calls,
+                    entry.rejections,
+                    entry.errors,
+                    f'{average:.3f}',
+                ]
+            )
+        if not rows:
+            return await ctx.send('No preconditions are registered.')
+        headers = [
+            'Name',
+            'Type',
+            'Priority',
+            'Guilds',
+            'Calls',
+            'Rejections',
+            'Errors',
+            'Avg ms',
+        ]
+        table = tabulate.tabulate(rows, headers, disable_numparse=True)
+        await ctx.send(f'```prolog\n{table}\n```')
+
     @commands.command(hidden=True, aliases=['debug'])
     @checks.is_owner()
     async def eval(self, ctx, *, code: str):
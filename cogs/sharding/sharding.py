@@ -4,18 +4,17 @@ import datetime
 from disnake.ext import commands
 
 from utils import checks
+from utils.lazy import lazy_import
 from utils.runtime import CoreMode
 
 try:
-    import tabulate
-    import psutil
+    # only imported once the shards command or an info request needs them
+    tabulate = lazy_import('tabulate')
+    psutil = lazy_import('psutil')
 except ImportError:
     raise RuntimeError('tabulate and psutil are required for this cog')
 
 
-tabulate.MIN_PADDING = 0  # makes for a neater table
-
-
 def gather_info(heleus):
     return {
         'status': heleus.settings[heleus.instance_id]['mode'].value,
@@ -128,7 +127,13 @@ class Sharding(commands.Cog):
                     else '',
                 ]
                 table.append(line)
-        table = f'```prolog\n{tabulate.tabulate(table, tablefmt="psql", headers="firstrow")}\n```'
+        # no padding makes for a neater table, restored for other tables
+        padding, tabulate.MIN_PADDING = tabulate.MIN_PADDING, 0
+        try:
+            table = tabulate.tabulate(table, tablefmt="psql", headers="firstrow")
+        finally:
+            tabulate.MIN_PADDING = padding
+        table = f'```prolog\n{table}\n```'
         await msg.edit(content=table)
 
     @shards.command()
@@ -2,8 +2,9 @@
 
 import argparse
 import asyncio
-import bz2
+import atexit
 import datetime
+import json
 import logging
 import os
 import platform
@@ -12,16 +13,65 @@ import threading
 import time
 import uuid
 import warnings
-from concurrent.futures import TimeoutError, ThreadPoolExecutor
+import concurrent.futures
+from concurrent.futures import TimeoutError
 from hashlib import sha256
 
-import coredis
-import dill
 import disnake as discord
 from disnake import utils as dutils
 from disnake.ext import commands
 
+from utils import admission, metrics
+from utils.app_commands import (
+    COMMAND_IDS_KEY,
+    RELEASE_LOCK_SCRIPT,
+    SYNC_HASH_KEY,
+    SYNC_HASH_TTL,
+    SYNC_LOCK_KEY,
+    SYNC_LOCK_TTL,
+    definitions_hash,
+    slash_command_ids,
+)
+from utils.boot import BOOT_KEEP, BOOT_KEY, BootTimer, format_profile
+from utils.http import start_server
+from utils.lazy import import_times, lazy_import
+from utils.lag import LagMonitor, SlowCallbackMonitor
+from utils.listeners import ListenerProfiler
+from utils.logs import (
+    ContextFilter,
+    JSONFormatter,
+    LogCompressor,
+    LogPipeline,
+    RotatingLogHandler,
+)
+from utils.memory import parse_size, plan_cache_policy
+from utils.message_cache import MessageCache
+from utils.sentry import SentryHandler, SentryReporter
 from utils.storage import RedisCollection
+from utils.task_tracker import TaskTracker
+
+
+# not needed until the bot is created, so not imported for --help etc
+coredis = lazy_import('coredis')
+dill = lazy_import('dill')
+
+
+class _TimedLoader:
+    """Wraps a module loader to time how long executing the module takes."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.elapsed = 0.0
+
+    def __getattr__(self, item):
+        return getattr(self.loader, item)
+
+    def exec_module(self, module):
+        started = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.elapsed = time.perf_counter() - started
 
 
 class NoResponse:
@@ -56,6 +106,20 @@ def create_bot(auto_shard: bool):
                 raise AssertionError('No redis instance specified')
             self.test = kwargs.pop('test', False)
             self.args = kwargs.pop('cargs', None)
+            self.cache_policy = kwargs.pop('cache_policy', None)
+            # slim per-channel message cache for cogs, see utils.message_cache
+            self.message_cache = kwargs.pop('message_cache', None)
+            # (host, port) to serve OpenMetrics on, if any
+            self.metrics_address = kwargs.pop('metrics_address', None)
+            # command processing limits for Core's admission controller
+            self.guild_concurrency = kwargs.pop('guild_concurrency', 8)
+            self.shed_lag = kwargs.pop('shed_lag', 0.5)
+            slow_callback = kwargs.pop('slow_callback_threshold', 0.1)
+            listener_sample_rate = kwargs.pop('listener_sample_rate', None)
+            # accounts listener calls per cog and event when enabled
+            self.listener_profiler = None
+            if listener_sample_rate:
+                self.listener_profiler = ListenerProfiler(listener_sample_rate)
             self.boot_time = (
                 time.time()
             )  # for uptime tracking, we'll use this later
@@ -63,6 +127,21 @@ def create_bot(auto_shard: bool):
             self.instance_id = sha256(
                 f'{platform.node()}_{os.getcwd()}_{self.args.shard_id}_{self.args.shard_count}'.encode()
             ).hexdigest()
+            # times startup phases, up to the first on_ready
+            self.boot = kwargs.pop('boot_timer', None) or BootTimer()
+            # extension -> (import seconds, setup seconds) of its last load
+            self.cog_timings = {}
+            # slash command name -> ID, shared by the process that synced
+            self.command_ids = {}
+            # bumped after each sync, for CommandFormatter to reindex
+            self.command_sync_count = 0
+            # whether the command cache was fetched for the coming sync
+            self._commands_cached = False
+            # queues error events for Sentry, see utils.sentry
+            self.error_reporter = kwargs.pop('error_reporter', None)
+            self.log_pipeline = kwargs.pop('log_pipeline', None)
+            if self.log_pipeline is not None:
+                self.log_pipeline.context.instance_id = self.instance_id
             self.logger = logging.getLogger('heleus')
             self.logger.info('Heleus is booting, please wait...')
             self.settings = RedisCollection(self.redis, 'settings')
@@ -75,7 +154,9 @@ def create_bot(auto_shard: bool):
             self.pubsub_id = f'heleus.{db}.pubsub.code'
             self._pubsub_futures = {}  # futures temporarily stored here
             self._pubsub_broadcast_cache = {}
-            self._pubsub_pool = ThreadPoolExecutor(max_workers=1)
+            self._pubsub_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1
+            )
             self.t1 = threading.Thread(
                 name='pubsub cache',
                 target=self._pubsub_cache_loop,
@@ -87,19 +168,259 @@ def create_bot(auto_shard: bool):
             else:
                 self.autoload = None
             self.loader = kwargs.pop('loader', 'cogs.core')
+            # reload cogs when their source changes, see utils.watcher
+            self.watch_cogs = kwargs.pop('watch_cogs', False)
             super().__init__(*args, **kwargs)
 
             self.ready = False  # we expect the loader to set this once ready
+            self.lag_monitor = LagMonitor(self.loop)
+            self.slow_callbacks = SlowCallbackMonitor(
+                self.lag_monitor, slow_callback
+            )
+            self.task_tracker = TaskTracker(self.loop)
+            self._setup_metrics()
+
+        def _setup_metrics(self):
+            self._messages_seen = metrics.Counter(
+                'heleus_messages', 'Messages received from the gateway.'
+            )
+            self._pubsub_expired = metrics.Counter(
+                'heleus_pubsub_expired',
+                'Broadcast RPC requests that timed out waiting for shards.',
+            )
+            metrics.Gauge(
+                'heleus_pubsub_outstanding',
+                'RPC requests waiting for a response.',
+                callback=lambda: len(self._pubsub_futures),
+            )
+            metrics.Gauge(
+                'heleus_event_loop_lag_seconds',
+                'How late the event loop ran the lag monitor timer.',
+                callback=lambda: self.lag_monitor.lag,
+            )
+            metrics.Gauge(
+                'heleus_gateway_latency_seconds',
+                'Gateway heartbeat latency per shard.',
+                labels=('shard',),
+                callback=self._gateway_latencies,
+            )
+            metrics.Counter(
+                'heleus_listener_calls',
+                'Event listener calls, by cog and event.',
+                labels=('cog', 'event'),
+                callback=lambda: self._listener_stats('calls'),
+            )
+            metrics.Counter(
+                'heleus_listener_errors',
+                'Event listener exceptions, by cog and event.',
+                labels=('cog', 'event'),
+                callback=lambda: self._listener_stats('errors'),
+            )
+            metrics.Counter(
+                'heleus_listener_seconds',
+                'Estimated wall time spent in event listeners.',
+                labels=('cog', 'event'),
+                callback=lambda: self._listener_stats('estimated_time'),
+            )
+            metrics.Gauge(
+                'heleus_cache_objects',
+                'Objects held in each cache.',
+                labels=('cache',),
+                callback=self._cache_sizes,
+            )
+
+        def _load_from_module_spec(self, spec, key):
+            # times the module's import separately from its setup function
+            loader = _TimedLoader(spec.loader)
+            spec.loader = loader
+            started = time.perf_counter()
+            try:
+                super()._load_from_module_spec(spec, key)
+            finally:
+                spec.loader = loader.loader
+                module = sys.modules.get(key)
+                if module is not None:
+                    module.__loader__ = loader.loader
+            total = time.perf_counter() - started
+            timing = (loader.elapsed, total - loader.elapsed)
+            self.cog_timings[key] = timing
+            self.boot.record_cog(key, *timing)
+
+        async def wait_for(self, *args, **kwargs):
+            # commands waiting on users don't count towards guild limits
+            async with admission.waiting():
+                return await super().wait_for(*args, **kwargs)
+
+        async def close(self):
+            await super().close()
+            if self.error_reporter is not None:
+                await self.error_reporter.close()
+
+        async def _cache_application_commands(self):
+            await super()._cache_application_commands()
+            self._commands_cached = True
+
+        async def _load_synced_commands(self, digest):
+            """Uses the stored command IDs if they match the definitions."""
+            stored = await self.redis.get(SYNC_HASH_KEY)
+            if stored is None or stored.decode() != digest:
+                return False
+            ids = await self.redis.hgetall(COMMAND_IDS_KEY)
+            self.command_ids = {k.decode(): int(v) for k, v in ids.items()}
+            self.command_sync_count += 1
+            return True
+
+        def _commands_registered(self):
+            """Returns whether Discord has every global command defined."""
+            registered = self._connection._global_application_commands
+            global_commands, _ = self._ordered_unsynced_commands(
+                self._test_guilds
+            )
+            names = {x.name for x in registered.values()}
+            return all(x.name in names for x in global_commands)
+
+        async def _sync_application_commands(self):
+            """Syncs application commands from one process at a time.
+
+            The definitions are hashed, and when they match the last synced
+            hash in Redis, and the commands cached from Discord include them,
+            nothing is synced. Otherwise one process takes a lock and syncs
+            while the others wait for it.
+            """
+            if not self._command_sync_flags._sync_enabled or self.is_closed():
+                return
+            # disnake caches before the first sync, but not delayed ones
+            fresh, self._commands_cached = self._commands_cached, False
+            digest = definitions_hash(
+                *self._ordered_unsynced_commands(self._test_guilds)
+            )
+            if (
+                await self._load_synced_commands(digest)
+                and self._commands_registered()
+            ):
+                self.logger.debug('Application commands are already synced.')
+                return
+            acquired = await self.redis.set(
+                SYNC_LOCK_KEY,
+                self.instance_id,
+                condition=coredis.PureToken.NX,
+                ex=SYNC_LOCK_TTL,
+            )
+            if not acquired:
+                deadline = time.monotonic() + SYNC_LOCK_TTL
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(1)
+                    if await self._load_synced_commands(digest):
+                        return
+                    if not await self.redis.exists([SYNC_LOCK_KEY]):
+                        break
+                self.logger.warning(
+                    'Another process failed to sync application commands, '
+                    'syncing them here.'
+                )
+                fresh = False  # it may have synced some of them
+            try:
+                if not fresh:
+                    await super()._cache_application_commands()
+                await super()._sync_application_commands()
+                if not self._commands_registered():
+                    # disnake only warns when a sync fails, so leave the hash
+                    # for the next process to try again
+                    return
+                registered = self._connection._global_application_commands
+                self.command_ids = slash_command_ids(registered.values())
+                await self.redis.delete([COMMAND_IDS_KEY])
+                if self.command_ids:
+                    await self.redis.hset(COMMAND_IDS_KEY, self.command_ids)
+                await self.redis.set(SYNC_HASH_KEY, digest, ex=SYNC_HASH_TTL)
+                self.command_sync_count += 1
+                self.logger.info('Synced application commands.')
+            finally:
+                if acquired:
+                    await self.redis.eval(
+                        RELEASE_LOCK_SCRIPT,
+                        keys=[SYNC_LOCK_KEY],
+                        args=[self.instance_id],
+                    )
+
+        @staticmethod
+        def _event_name(func, name):
+            if name is dutils.MISSING:
+                return func.__name__
+            return name if isinstance(name, str) else f'on_{name.value}'
+
+        def add_listener(self, func, name=dutils.MISSING):
+            if self.listener_profiler is not None:
+                func = self.listener_profiler.wrap(
+                    func, self._event_name(func, name)
+                )
+            super().add_listener(func, name)
+
+        def remove_listener(self, func, name=dutils.MISSING):
+            if self.listener_profiler is not None:
+                func = self.listener_profiler.unwrap(
+                    func, self._event_name(func, name)
+                )
+            super().remove_listener(func, name)
+
+        def _listener_stats(self, field):
+            if self.listener_profiler is None:
+                return []
+            return [
+                ((x.cog, x.event), getattr(x, field))
+                for x in self.listener_profiler.stats.values()
+            ]
+
+        def _gateway_latencies(self):
+            latencies = getattr(self, 'latencies', None)
+            if latencies is None:
+                latencies = [(self.shard_id, self.latency)]
+            return [((str(shard),), latency) for shard, latency in latencies]
+
+        def _cache_sizes(self):
+            sizes = [
+                (('guilds',), len(self.guilds)),
+                (('members',), sum(len(g._members) for g in self.guilds)),
+                (('users',), len(self.users)),
+                (('messages',), len(self.cached_messages)),
+            ]
+            if self.message_cache is not None:
+                sizes.append((('compact_messages',), len(self.message_cache)))
+            return sizes
+
+        async def _start_metrics_server(self):
+            async def scrape(*_):
+                return (
+                    200,
+                    metrics.CONTENT_TYPE,
+                    metrics.default_registry.render(),
+                )
+
+            host, port = self.metrics_address
+            self._metrics_server = await start_server(
+                {'/metrics': scrape}, host, port
+            )
+            self.logger.info(
+                f'Serving metrics on http://{host}:{port}/metrics'
+            )
 
         def init(self):
             """Initializes the bot."""
+            self.task_tracker.install()
             # pubsub
             self.t1.start()
             self.loop.create_task(self._pubsub_loop())
+            self.lag_monitor.start()
+            self.slow_callbacks.start()
+            if self.error_reporter is not None:
+                self.error_reporter.start(self.loop)
+            if self.metrics_address is not None:
+                self.loop.create_task(self._start_metrics_server())
 
             # load the core cog
             default = 'cogs.core'
-            self.load_extension(self.loader)
+            with self.boot.phase('core'):
+                self.load_extension(self.loader)
             if loader != default:
                 self.logger.warning(
                     f'Using third-party loader and core cog, {loader}. No support will be provided if anything goes wrong!'
@@ -196,10 +517,10 @@ def create_bot(auto_shard: bool):
             while True:
                 for k, v in dict(self._pubsub_broadcast_cache).items():
                     contents = [v[x] for x in v if x != 'expires']
-                    if (
-                        v['expires'] < time.monotonic()
-                        or NoResponse() not in contents
-                    ):
+                    expired = v['expires'] < time.monotonic()
+                    if expired or NoResponse() not in contents:
+                        if NoResponse() in contents:
+                            self._pubsub_expired.inc()
                         del v['expires']
                         self._pubsub_futures[k].set_result(v)
                         del self._pubsub_futures[k]
@@ -238,7 +559,12 @@ def create_bot(auto_shard: bool):
             except TimeoutError:
                 return False
 
+        async def on_connect(self):
+            self.boot.stop('connect')
+            self.boot.start('guilds')
+
         async def on_ready(self):
+            self.boot.stop('guilds')
             await self.redis.set(
                 '__info__',
                 f'This database is used by the Heleus Discord bot, logged in as user {self.user}.',
@@ -249,17 +575,53 @@ def create_bot(auto_shard: bool):
                 self.logger.info(
                     f'Shard {self.shard_id + 1} of {self.shard_count}.'
                 )
-            app_info = await self.application_info()
+            with self.boot.phase('application_info'):
+                app_info = await self.application_info()
             self.invite_url = dutils.oauth_url(app_info.id)
             self.logger.info(f'Invite URL: {self.invite_url}')
             self.team = app_info.team
+            if not self.boot.finished:
+                await self._finish_boot()
             if self.test:
                 self.logger.info('Test complete, logging out...')
                 await self.close()
                 exit(0)  # jenkins' little helper
 
+        async def _finish_boot(self):
+            profile = self.boot.finish()
+            summary = format_profile(profile)
+            self.logger.info(
+                f'Ready {profile["total"]:.2f} seconds after starting:\n'
+                f'{summary}'
+            )
+            key = f'{BOOT_KEY}:{self.instance_id}'
+            await self.redis.lpush(key, [json.dumps(profile)])
+            await self.redis.ltrim(key, 0, BOOT_KEEP - 1)
+            if self.test:
+                # for CI to track startup time
+                print(summary)
+                print(f'BOOT_PROFILE {json.dumps(profile)}')
+
         async def on_message(self, message):
-            pass
+            self._messages_seen.inc()
+            if self.message_cache is not None:
+                self.message_cache.add(message)
+
+        async def on_raw_message_edit(self, payload):
+            if self.message_cache is not None:
+                self.message_cache.update(payload)
+
+        async def on_raw_message_delete(self, payload):
+            if self.message_cache is not None:
+                self.message_cache.mark_deleted((payload.message_id,))
+
+        async def on_raw_bulk_message_delete(self, payload):
+            if self.message_cache is not None:
+                self.message_cache.mark_deleted(payload.message_ids)
+
+        async def on_guild_channel_delete(self, channel):
+            if self.message_cache is not None:
+                self.message_cache.remove_channel(channel.id)
 
         def __repr__(self):
             return '<Heleus username={} shard_id={} shard_count={}>'.format(
@@ -281,6 +643,8 @@ async def send_cmd_help(ctx):
 
 
 if __name__ == '__main__':
+    boot_timer = BootTimer()
+    boot_timer.start('setup')
     # Get defaults for argparse
     help_description = os.environ.get(
         'HELEUS_HELP',
@@ -327,8 +691,97 @@ if __name__ == '__main__':
         )
         exit(4)
 
+    compact_cache = os.environ.get('HELEUS_COMPACT_MESSAGE_CACHE', '')
+    compact_cache = compact_cache.lower() in ('1', 'true', 'yes')
+    per_channel_cache = os.environ.get('HELEUS_MESSAGE_CACHE_PER_CHANNEL', 100)
+    try:
+        per_channel_cache = int(per_channel_cache)
+    except ValueError:
+        print(
+            'Error parsing environment variable HELEUS_MESSAGE_CACHE_PER_CHANNEL\n'
+            'Please check that this can be converted to an integer'
+        )
+        exit(4)
+
+    memory_budget = os.environ.get('HELEUS_MEMORY_BUDGET', None)
+
+    slow_callback = os.environ.get('HELEUS_SLOW_CALLBACK_MS', 100)
+    try:
+        slow_callback = int(slow_callback)
+    except ValueError:
+        print(
+            'Error parsing environment variable HELEUS_SLOW_CALLBACK_MS\n'
+            'Please check that this can be converted to an integer'
+        )
+        exit(4)
+
+    try:
+        guild_concurrency = int(os.environ.get('HELEUS_GUILD_CONCURRENCY', 8))
+        shed_lag = float(os.environ.get('HELEUS_SHED_LAG', 0.5))
+    except ValueError:
+        print(
+            'Error parsing environment variables HELEUS_GUILD_CONCURRENCY or '
+            'HELEUS_SHED_LAG\n'
+            'Please check that these can be converted to numbers'
+        )
+        exit(4)
+
+    listener_sample_rate = os.environ.get('HELEUS_LISTENER_SAMPLE_RATE', None)
+    try:
+        if listener_sample_rate is not None:
+            listener_sample_rate = float(listener_sample_rate)
+    except ValueError:
+        print(
+            'Error parsing environment variable HELEUS_LISTENER_SAMPLE_RATE\n'
+            'Please check that this can be converted to a number'
+        )
+        exit(4)
+
+    log_format = os.environ.get('HELEUS_LOG_FORMAT', 'text')
+    log_max_size = os.environ.get('HELEUS_LOG_MAX_SIZE', '100MiB')
+    log_retention_size = os.environ.get('HELEUS_LOG_RETENTION_SIZE', '1GiB')
+    try:
+        log_rotate_hours = float(os.environ.get('HELEUS_LOG_ROTATE_HOURS', 24))
+        log_retention_days = float(
+            os.environ.get('HELEUS_LOG_RETENTION_DAYS', 30)
+        )
+    except ValueError:
+        print(
+            'Error parsing environment variables HELEUS_LOG_ROTATE_HOURS or '
+            'HELEUS_LOG_RETENTION_DAYS\n'
+            'Please check that these can be converted to numbers'
+        )
+        exit(4)
+
+    sentry_dsn = os.environ.get('HELEUS_SENTRY_DSN', None)
+    try:
+        sentry_sample_rate = float(
+            os.environ.get('HELEUS_SENTRY_SAMPLE_RATE', 1.0)
+        )
+    except ValueError:
+        print(
+            'Error parsing environment variable HELEUS_SENTRY_SAMPLE_RATE\n'
+            'Please check that this can be converted to a number'
+        )
+        exit(4)
+
+    metrics_host = os.environ.get('HELEUS_METRICS_HOST', '127.0.0.1')
+    metrics_port = os.environ.get('HELEUS_METRICS_PORT', None)
+    try:
+        if metrics_port is not None:
+            metrics_port = int(metrics_port)
+    except ValueError:
+        print(
+            'Error parsing environment variable HELEUS_METRICS_PORT\n'
+            'Please check that this can be converted to an integer'
+        )
+        exit(4)
+
     load_cogs = os.environ.get('HELEUS_LOAD_COGS', None)
 
+    watch_cogs = os.environ.get('HELEUS_WATCH_COGS', '')
+    watch_cogs = watch_cogs.lower() in ('1', 'true', 'yes')
+
     intents = os.environ.get('HELEUS_INTENTS', 'all')
 
     test_guilds = os.environ.get('HELEUS_TEST_GUILDS', None)
@@ -357,6 +810,104 @@ if __name__ == '__main__':
         default=message_cache,
         type=int,
     )
+    parser.add_argument(
+        '--compact_message_cache',
+        help='caches slim message records in Heleus.message_cache, bounded per '
+        'channel and by --message_cache_count, instead of full messages',
+        action='store_true',
+        default=compact_cache,
+    )
+    parser.add_argument(
+        '--message_cache_per_channel',
+        help='sets the maximum amount of messages per channel in the compact '
+        'message cache',
+        default=per_channel_cache,
+        type=int,
+    )
+    parser.add_argument(
+        '--memory_budget',
+        help='picks member caching, chunking and the message cache size to fit '
+        'a per-shard memory target, e.g. 1GiB (overrides --message_cache_count)',
+        default=memory_budget,
+    )
+    parser.add_argument(
+        '--slow_callback_ms',
+        help='logs callbacks that block the event loop for longer than this',
+        default=slow_callback,
+        type=int,
+    )
+    parser.add_argument(
+        '--guild_concurrency',
+        help='the most commands processed at once per guild',
+        default=guild_concurrency,
+        type=int,
+    )
+    parser.add_argument(
+        '--shed_lag',
+        help='sheds non-owner commands while the event loop lags by more than '
+        'this many seconds',
+        default=shed_lag,
+        type=float,
+    )
+    parser.add_argument(
+        '--listener_sample_rate',
+        help='accounts event listener calls per cog, timing this share of them '
+        '(between 0 and 1)',
+        default=listener_sample_rate,
+        type=float,
+    )
+    parser.add_argument(
+        '--log_format',
+        help='writes logs as plain text or JSON lines',
+        choices=['text', 'json'],
+        default=log_format,
+    )
+    parser.add_argument(
+        '--log_max_size',
+        help='rotates log files once they reach this size, e.g. 100MiB '
+        '(0 to disable)',
+        default=log_max_size,
+    )
+    parser.add_argument(
+        '--log_rotate_hours',
+        help='rotates log files after this many hours (0 to disable)',
+        default=log_rotate_hours,
+        type=float,
+    )
+    parser.add_argument(
+        '--log_retention_days',
+        help='deletes compressed logs older than this many days (0 to disable)',
+        default=log_retention_days,
+        type=float,
+    )
+    parser.add_argument(
+        '--log_retention_size',
+        help='deletes the oldest compressed logs past this total size, e.g. '
+        '1GiB (0 to disable)',
+        default=log_retention_size,
+    )
+    parser.add_argument(
+        '--sentry_dsn',
+        help='reports errors to the Sentry project with this DSN',
+        default=sentry_dsn,
+    )
+    parser.add_argument(
+        '--sentry_sample_rate',
+        help='reports this share of errors to Sentry (between 0 and 1)',
+        default=sentry_sample_rate,
+        type=float,
+    )
+    parser.add_argument(
+        '--metrics_port',
+        help='serves OpenMetrics on this port at /metrics',
+        default=metrics_port,
+        type=int,
+    )
+    parser.add_argument(
+        '--metrics_host',
+        help='the host to serve metrics on',
+        default=metrics_host,
+    )
     parser.add_argument(
         '--test_guilds',
         help='a comma separated list of guild IDs to configure as test servers',
@@ -373,6 +924,12 @@ if __name__ == '__main__':
         help='a comma separated list of cogs to automatically load on startup',
         default=load_cogs,
     )
+    parser.add_argument(
+        '--watch_cogs',
+        help='reloads cogs on every shard when their source files change',
+        action='store_true',
+        default=watch_cogs,
+    )
     parser.add_argument(
         '--intents',
         help='a comma separated list of Gateway Intents to enable',
@@ -416,6 +973,30 @@ if __name__ == '__main__':
     if cargs.token is None:
         exit(parser.print_usage())
 
+    if cargs.shard_id is not None:  # usability
+        cargs.shard_id -= 1
+
+    budget = None
+    if cargs.memory_budget:
+        try:
+            budget = parse_size(cargs.memory_budget)
+        except ValueError:
+            print(
+                'Error parsing the memory budget\n'
+                'Please use a size such as 512MiB or 1GiB'
+            )
+            exit(4)
+
+    try:
+        log_max_size = parse_size(cargs.log_max_size)
+        log_retention_size = parse_size(cargs.log_retention_size)
+    except ValueError:
+        print(
+            'Error parsing the log size limits\n'
+            'Please use a size such as 100MiB or 1GiB'
+        )
+        exit(4)
+
     if cargs.uvloop:
         try:
             # noinspection PyUnresolvedReferences
@@ -432,19 +1013,21 @@ if __name__ == '__main__':
         if not os.path.exists('logs'):
             os.mkdir('logs')
 
-        # Compress logfiles that were left over from the last run
-        os.chdir('logs')
-        if not os.path.exists('old'):
-            os.mkdir('old')
-        for item in os.listdir('.'):
+        # Compress logfiles that were left over from the last run, and the
+        # ones rotated while running, in the background
+        log_compressor = LogCompressor(
+            os.path.join('logs', 'old'),
+            max_age=cargs.log_retention_days * 86400,
+            max_bytes=log_retention_size,
+        )
+        for item in os.listdir('logs'):
+            path = os.path.join('logs', item)
             if item.endswith('.log'):
-                with bz2.open(item + '.bz2', 'w') as f:
-                    f.write(open(item, 'rb').read())
-                os.remove(item)
-        for item in os.listdir('.'):
-            if item.endswith('.gz') or item.endswith('.bz2'):
-                os.rename(item, 'old/' + item)
-        os.chdir('..')
+                log_compressor.submit(path)
+            elif item.endswith('.gz') or item.endswith('.bz2'):
+                os.rename(path, os.path.join('logs', 'old', item))
+        log_compressor.start()
+        atexit.register(log_compressor.stop)
 
     # Define a format
     now = (
@@ -453,7 +1036,13 @@ if __name__ == '__main__':
         .replace(':', '-')
         .split('.')[0]
     )
-    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    if cargs.log_format == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+
+    # Handlers run on a listener thread, loggers only queue records
+    log_pipeline = LogPipeline(context=ContextFilter(shard_id=cargs.shard_id))
 
     # Setting up loggers
     logger = logging.getLogger('heleus')
@@ -463,26 +1052,64 @@ if __name__ == '__main__':
     else:
         logger.setLevel(logging.INFO)
         sync_commands_debug = False
+    log_pipeline.attach(logger)
 
     if not cargs.stateless:
-        handler = logging.FileHandler(f'logs/heleus_{now}.log')
+        handler = RotatingLogHandler(
+            f'logs/heleus_{now}.log',
+            log_compressor,
+            log_max_size,
+            cargs.log_rotate_hours * 3600,
+        )
         handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        log_pipeline.add_handler(handler, 'heleus')
 
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_pipeline.add_handler(handler, 'heleus')
 
     discord_logger = logging.getLogger('discord')
     if cargs.debug:
         discord_logger.setLevel(logging.DEBUG)
     else:
         discord_logger.setLevel(logging.INFO)
+    log_pipeline.attach(discord_logger)
 
     if not cargs.stateless:
-        handler = logging.FileHandler(f'logs/discord_{now}.log')
+        handler = RotatingLogHandler(
+            f'logs/discord_{now}.log',
+            log_compressor,
+            log_max_size,
+            cargs.log_rotate_hours * 3600,
+        )
+        handler.setFormatter(formatter)
+        log_pipeline.add_handler(handler, 'discord')
+    else:
+        # without a log file, print what logging.lastResort used to
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setLevel(logging.WARNING)
         handler.setFormatter(formatter)
-        discord_logger.addHandler(handler)
+        log_pipeline.add_handler(handler, 'discord')
+
+    log_pipeline.start()
+
+    error_reporter = None
+    if cargs.sentry_dsn:
+        try:
+            error_reporter = SentryReporter(
+                cargs.sentry_dsn, cargs.sentry_sample_rate
+            )
+        except ValueError:
+            print(
+                'Error parsing the Sentry DSN\n'
+                'Please check that it is in the form '
+                'https://key@host/project'
+            )
+            exit(4)
+        # attached directly, as only the loggers' records carry exceptions
+        sentry_handler = SentryHandler(error_reporter)
+        logger.addHandler(sentry_handler)
+        discord_logger.addHandler(sentry_handler)
 
     if cargs.intents:
         intents_list = cargs.intents.split(',')
@@ -511,6 +1138,27 @@ if __name__ == '__main__':
             'You have been warned!'
         )
 
+    cache_policy = None
+    if budget is not None:
+        cache_policy = plan_cache_policy(budget, intents)
+        cache_kwargs = cache_policy.to_kwargs()
+        logger.info(
+            f'Using the memory budgeted cache policy {cache_policy!r}.'
+        )
+    else:
+        cache_kwargs = {'max_messages': cargs.message_cache_count}
+
+    compact_message_cache = None
+    if cargs.compact_message_cache:
+        if cache_policy is not None:
+            max_messages = cache_policy.compact_messages
+        else:
+            max_messages = cargs.message_cache_count
+        compact_message_cache = MessageCache(
+            max_messages, cargs.message_cache_per_channel
+        )
+        cache_kwargs['max_messages'] = None
+
     if cargs.test_guilds:
         test_guilds = [int(id) for id in test_guilds.split(',')]
 
@@ -528,9 +1176,6 @@ if __name__ == '__main__':
             "supported. DO NOT expect any support if things go wrong. You've been warned!"
         )
 
-    if cargs.shard_id is not None:  # usability
-        cargs.shard_id -= 1
-
     # Redis connection attempt
     redis_conn = coredis.Redis(
         host=cargs.host, port=cargs.port, db=cargs.db, password=cargs.password
@@ -547,6 +1192,15 @@ if __name__ == '__main__':
         warnings.simplefilter('ignore', DeprecationWarning)
         loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
 
+    if cargs.test:
+        # for CI to track import time, in a fresh interpreter
+        total, slowest = import_times('heleus', loader)
+        print(f'Importing Heleus takes {total * 1000:.0f} ms, slowest:')
+        for name, seconds in slowest:
+            print(f'  {name}: {seconds * 1000:.0f} ms')
+
+    boot_timer.stop('setup')
+
     # noinspection PyUnboundLocalVariable
     heleus = heleus_cls(
         load_cogs=cargs.cogs,
@@ -560,7 +1214,6 @@ if __name__ == '__main__':
         description=cargs.description,
         help_command=CustomHelp(),
         pm_help=None,
-        max_messages=message_cache,
         redis=redis_conn,
         cargs=cargs,
         test=cargs.test,
@@ -568,6 +1221,20 @@ if __name__ == '__main__':
         loader=loader,
         command_prefix=commands.when_mentioned,
         loop=loop,
+        cache_policy=cache_policy,
+        message_cache=compact_message_cache,
+        slow_callback_threshold=cargs.slow_callback_ms / 1000,
+        listener_sample_rate=cargs.listener_sample_rate,
+        guild_concurrency=cargs.guild_concurrency,
+        shed_lag=cargs.shed_lag,
+        watch_cogs=cargs.watch_cogs,
+        log_pipeline=log_pipeline,
+        error_reporter=error_reporter,
+        boot_timer=boot_timer,
+        metrics_address=(cargs.metrics_host, cargs.metrics_port)
+        if cargs.metrics_port
+        else None,
+        **cache_kwargs,
     )  # heleus-specific args
 
     # Removing the help command here instead of using `help_command=None` in the bot
@@ -575,8 +1242,10 @@ if __name__ == '__main__':
     heleus.remove_command('help')
 
     async def run_bot():
-        await heleus.redis.ping()
+        with heleus.boot.phase('redis'):
+            await heleus.redis.ping()
         heleus.init()
+        heleus.boot.start('connect')
         await heleus.start(cargs.token)
 
     # noinspection PyBroadException
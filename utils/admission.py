@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+
+
+def priority():
+    """Marks a command as never being shed by the admission controller.
+
+    Can be used above or below the command decorator.
+    """
+
+    def decorator(func):
+        func.__heleus_priority__ = True
+        return func
+
+    return decorator
+
+
+class _Slot:
+    """A command's place in its guild's concurrency limit."""
+
+    __slots__ = ('guild', 'held')
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.held = False
+
+
+class _Guild:
+    __slots__ = ('semaphore', 'users')
+
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0  # admitted messages, holding a slot or waiting for one
+
+
+# the slot of the command being processed, see AdmissionController.waiting
+_slot = contextvars.ContextVar('admission_slot', default=None)
+
+
+@contextlib.asynccontextmanager
+async def waiting():
+    """Gives up the current command's slot while it waits on users.
+
+    Commands waiting for replies or reactions would otherwise hold their
+    guild's slots until they time out.
+    """
+    slot = _slot.get()
+    if slot is None or not slot.held:
+        yield
+        return
+    slot.held = False
+    slot.guild.semaphore.release()
+    try:
+        yield
+    finally:
+        await slot.guild.semaphore.acquire()
+        slot.held = True
+
+
+class AdmissionController:
+    """Decides whether a message gets to command processing under load.
+
+    Each guild (or DM channel) may only have a bounded amount of messages
+    in command processing at once, further ones wait for a slot, and while
+    the event loop is lagging behind everything but owner and priority
+    commands is shed.
+    """
+
+    def __init__(
+        self,
+        heleus,
+        lag_monitor,
+        prefilter,
+        max_per_guild=8,
+        lag_threshold=0.5,
+    ):
+        self.heleus = heleus
+        self.lag_monitor = lag_monitor
+        self.prefilter = prefilter
+        self.max_per_guild = max_per_guild
+        self.lag_threshold = lag_threshold
+        self.priority_commands = set()  # qualified names, as an alternative
+        self.admitted = 0
+        self.prioritised = 0
+        self.queued = 0  # messages that had to wait for a slot
+        self.shed = collections.Counter()  # by reason
+        self._guilds = {}
+
+    @staticmethod
+    def key(message):
+        guild = message.guild
+        return guild.id if guild is not None else message.channel.id
+
+    def _is_priority(self, message):
+        if message.author.id in getattr(self.heleus, 'owners', ()):
+            return True
+        content = self.prefilter.strip_prefix(message)
+        if content is None:
+            return False
+        parts = content.split(None, 1)
+        if not parts:
+            return False
+        command = self.heleus.all_commands.get(parts[0])
+        if command is None:
+            return False
+        return (
+            command.qualified_name in self.priority_commands
+            or getattr(command, '__heleus_priority__', False)
+            or getattr(command.callback, '__heleus_priority__', False)
+        )
+
+    async def admit(self, message):
+        """Admits a message, returning its slot, or None if it was shed.
+
+        Messages wait for a slot while their guild is at its limit, except
+        for priority ones. Slots must be released once the message has been
+        processed, by the task that admitted it.
+        """
+        priority = None
+        if self.lag_monitor.lag >= self.lag_threshold:
+            priority = self._is_priority(message)
+            if not priority:
+                self.shed['loop_lag'] += 1
+                return None
+            self.prioritised += 1
+        key = self.key(message)
+        guild = self._guilds.get(key)
+        if guild is None:
+            guild = self._guilds[key] = _Guild(self.max_per_guild)
+        guild.users += 1
+        slot = _Slot(guild)
+        _slot.set(slot)
+        self.admitted += 1
+        if guild.semaphore.locked():
+            if priority is None:
+                priority = self._is_priority(message)
+            if priority:
+                return slot  # without taking a slot
+            self.queued += 1
+        try:
+            await guild.semaphore.acquire()
+        except BaseException:
+            self.release(message, slot)
+            raise
+        slot.held = True
+        return slot
+
+    def release(self, message, slot):
+        if slot.held:
+            slot.held = False
+            slot.guild.semaphore.release()
+        slot.guild.users -= 1
+        if slot.guild.users <= 0:
+            self._guilds.pop(self.key(message), None)
+
+    @property
+    def in_flight(self):
+        return sum(x.users for x in self._guilds.values())
@@ -0,0 +1,50 @@
+import hashlib
+import json
+
+from disnake import ApplicationCommandType
+
+# the hash of the last synced command definitions, and who's syncing them
+SYNC_HASH_KEY = 'command_sync_hash'
+SYNC_HASH_TTL = 86400  # seconds before the commands are synced regardless
+SYNC_LOCK_KEY = 'command_sync_lock'
+SYNC_LOCK_TTL = 120  # seconds a sync may take before another can start
+# deletes the lock only if this process still holds it
+RELEASE_LOCK_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+# slash command name -> ID, as registered by the last sync
+COMMAND_IDS_KEY = 'command_ids'
+
+
+def definitions_hash(global_commands, guild_commands) -> str:
+    """Hashes application command definitions as they'd be sent to Discord.
+
+    Commands are sorted by name first, so that the order cogs were loaded
+    in doesn't change the hash.
+    """
+
+    def dump(commands):
+        return sorted(
+            (x.to_dict() for x in commands),
+            key=lambda x: (x.get('type', 1), x['name']),
+        )
+
+    definitions = {
+        'global': dump(global_commands),
+        'guilds': {str(k): dump(v) for k, v in guild_commands.items()},
+    }
+    return hashlib.sha256(
+        json.dumps(definitions, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def slash_command_ids(commands) -> dict:
+    """Maps the names of registered slash commands to their IDs."""
+    return {
+        x.name: x.id
+        for x in commands
+        if x.type == ApplicationCommandType.chat_input
+    }
@@ -0,0 +1,96 @@
+import contextlib
+import os
+import time
+
+from utils.lazy import lazy_import
+
+tabulate = lazy_import('tabulate')
+
+
+# boot profiles are kept in a Redis list per instance, newest first
+BOOT_KEY = 'boot_profiles'
+BOOT_KEEP = 10
+
+
+def process_age():
+    """Returns how long ago this process started, or None if unknown."""
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name can contain spaces, the fields after it can't
+            fields = f.read().rpartition(')')[2].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    return max(uptime - started, 0.0)
+
+
+class BootTimer:
+    """Times the phases of startup, up to the first on_ready.
+
+    Phases that never finish, such as connecting when the token is
+    invalid, are left out of the profile.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # name -> seconds, in the order they finished
+        self.cogs = {}  # extension -> (import seconds, setup seconds)
+        self.finished = False
+        self._running = {}
+        # the time spent before the launcher ran is mostly imports
+        age = process_age()
+        if age is not None:
+            self.phases['import'] = age
+
+    def start(self, name):
+        if not self.finished:
+            self._running[name] = time.perf_counter()
+
+    def stop(self, name):
+        started = self._running.pop(name, None)
+        if started is not None:
+            self.phases[name] = time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def record_cog(self, name, import_time, setup_time):
+        if not self.finished:
+            self.cogs[name] = (import_time, setup_time)
+
+    def finish(self) -> dict:
+        """Ends timing, returning the profile."""
+        self.finished = True
+        self._running.clear()
+        total = time.perf_counter() - self.started
+        return {
+            'time': time.time(),
+            'total': total + self.phases.get('import', 0.0),
+            'phases': dict(self.phases),
+            'cogs': {k: list(v) for k, v in self.cogs.items()},
+        }
+
+
+def format_profile(profile) -> str:
+    """Formats a boot profile as a table of phases, then of cogs."""
+    rows = [[k, f'{v * 1000:.0f}'] for k, v in profile['phases'].items()]
+    rows.append(['total', f'{profile["total"] * 1000:.0f}'])
+    text = tabulate.tabulate(rows, ['Phase', 'ms'], disable_numparse=True)
+    if profile['cogs']:
+        rows = [
+            [k, f'{i * 1000:.0f}', f'{s * 1000:.0f}']
+            for k, (i, s) in sorted(
+                profile['cogs'].items(), key=lambda x: -sum(x[1])
+            )
+        ]
+        text += '\n\n' + tabulate.tabulate(
+            rows, ['Cog', 'Import ms', 'Setup ms'], disable_numparse=True
+        )
+    return text
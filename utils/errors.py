@@ -0,0 +1,137 @@
+import collections
+import hashlib
+import os
+import time
+import traceback
+
+
+def fingerprint(command, exception):
+    """Identifies an error by its command, type and innermost frame."""
+    frame = '?'
+    # walk_tb doesn't read source files, unlike extract_tb
+    frames = list(traceback.walk_tb(exception.__traceback__))
+    if frames:
+        top, lineno = frames[-1]
+        code = top.f_code
+        frame = f'{os.path.basename(code.co_filename)}:{lineno} {code.co_name}'
+    return command, type(exception).__name__, frame
+
+
+class ErrorRecord:
+    """Everything seen of one kind of error, formatted once."""
+
+    __slots__ = (
+        'id',
+        'command',
+        'type',
+        'frame',
+        'traceback',
+        'count',
+        'suppressed',
+        'first_seen',
+        'last_seen',
+        'last_reported',
+        'replies',
+    )
+
+    def __init__(self, key, exception):
+        self.command, self.type, self.frame = key
+        self.id = hashlib.sha1(repr(key).encode()).hexdigest()[:8]
+        self.traceback = ''.join(
+            traceback.format_exception(
+                type(exception), exception, exception.__traceback__
+            )
+        )
+        self.count = 0
+        self.suppressed = 0  # occurrences since the last report
+        self.first_seen = self.last_seen = time.time()
+        self.last_reported = None
+        self.replies = {}  # channel ID -> when an error reply was last sent
+
+
+class ErrorTracker:
+    """Groups command errors by fingerprint to stop error storms.
+
+    The first occurrence of an error is reported, after which repeats are
+    only counted until `interval` seconds have passed, so a broken command
+    being spammed produces one log entry a minute rather than one per use.
+    """
+
+    def __init__(self, interval=60, keep=200):
+        self.interval = interval
+        self.keep = keep
+        self.records = collections.OrderedDict()  # key -> ErrorRecord
+        # (command, type) -> errors, kept when records are evicted
+        self.totals = collections.Counter()
+
+    def record(self, command, exception):
+        """Counts an error, returning its record and whether to report it.
+
+        The second value is None if the error shouldn't be reported, or how
+        many of its occurrences were suppressed since it was last reported.
+        """
+        key = fingerprint(command, exception)
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = ErrorRecord(key, exception)
+            if len(self.records) > self.keep:
+                self.records.popitem(last=False)
+        else:
+            self.records.move_to_end(key)
+        now = time.time()
+        record.count += 1
+        record.last_seen = now
+        self.totals[(record.command, record.type)] += 1
+        if (
+            record.last_reported is not None
+            and now - record.last_reported < self.interval
+        ):
+            record.suppressed += 1
+            return record, None
+        suppressed, record.suppressed = record.suppressed, 0
+        record.last_reported = now
+        return record, suppressed
+
+    def should_reply(self, record, channel_id):
+        """Returns whether to tell a channel about an error.
+
+        Each channel is told at most once per interval, so that an error
+        storm doesn't flood it with replies.
+        """
+        now = time.time()
+        last = record.replies.get(channel_id)
+        if last is not None and now - last < self.interval:
+            return False
+        record.replies = {
+            k: v for k, v in record.replies.items() if now - v < self.interval
+        }
+        record.replies[channel_id] = now
+        return True
+
+    def flush(self):
+        """Returns records with occurrences unreported for an interval.
+
+        Each is returned with its suppressed count, and marked reported.
+        Without this, the count for a storm that stopped would never be
+        reported, as that only happens on the next occurrence.
+        """
+        now = time.time()
+        due = []
+        for record in self.records.values():
+            if (
+                record.suppressed
+                and now - record.last_reported >= self.interval
+            ):
+                due.append((record, record.suppressed))
+                record.suppressed = 0
+                record.last_reported = now
+        return due
+
+    def get(self, error_id):
+        for record in self.records.values():
+            if record.id == error_id:
+                return record
+        return None
+
+    def top(self, count=10):
+        return sorted(self.records.values(), key=lambda x: -x.count)[:count]
@@ -0,0 +1,228 @@
+import ast
+import asyncio
+import importlib.util
+import logging
+
+import strictyaml
+from disnake.ext import commands
+
+from utils import yaml
+
+logger = logging.getLogger('heleus')
+
+
+def requirements(name) -> list:
+    """Returns the extensions an extension requires, without importing it.
+
+    Extensions declare these in a module level ``requires`` list, which is
+    read from the source so that loading can be ordered up front.
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        return []
+    try:
+        source = spec.loader.get_source(name)
+    except (ImportError, AttributeError):
+        return []
+    if source is None:
+        return []
+    for node in ast.parse(source).body:
+        if not isinstance(node, ast.Assign):
+            continue
+        if any(
+            isinstance(x, ast.Name) and x.id == 'requires'
+            for x in node.targets
+        ):
+            return list(ast.literal_eval(node.value))
+    return []
+
+
+def load_order(names, loaded=()):
+    """Orders extensions so that each comes after the ones it requires.
+
+    Returns the order, each extension's requirements, and the extensions
+    that can't be loaded mapped to why.
+    """
+    names = list(names)
+    requires = {}
+    failed = {}
+    order = []
+    state = {}  # name -> 'visiting' or 'done'
+
+    def visit(name):
+        if state.get(name) == 'done' or name in failed:
+            return
+        if state.get(name) == 'visiting':
+            failed[name] = 'It is part of a dependency cycle.'
+            return
+        state[name] = 'visiting'
+        try:
+            requires[name] = requirements(name)
+        except (ImportError, SyntaxError, ValueError) as e:
+            requires[name] = []
+            failed[name] = f'Its requirements could not be read: {e!r}'
+        for dependency in requires[name]:
+            if dependency in loaded:
+                continue
+            if dependency not in names:
+                failed.setdefault(
+                    name, f"It requires {dependency}, which isn't loaded."
+                )
+                continue
+            visit(dependency)
+            if dependency in failed:
+                failed.setdefault(
+                    name, f'It requires {dependency}, which failed to load.'
+                )
+        state[name] = 'done'
+        if name not in failed:
+            order.append(name)
+
+    for name in names:
+        visit(name)
+    return order, requires, failed
+
+
+# the manifest of cogs to load on first use, config/cogs.yml:
+#
+# lazy:
+#   cogs.command_log:
+#     commands:
+#     - audit
+#     events:
+#     - command_timed
+MANIFEST_SCHEMA = strictyaml.Map(
+    {
+        strictyaml.Optional('lazy'): strictyaml.MapPattern(
+            strictyaml.Str(),
+            strictyaml.Map(
+                {
+                    strictyaml.Optional('commands'): strictyaml.Seq(
+                        strictyaml.Str()
+                    ),
+                    strictyaml.Optional('events'): strictyaml.Seq(
+                        strictyaml.Str()
+                    ),
+                }
+            ),
+        )
+    }
+)
+yaml.register('cogs', MANIFEST_SCHEMA)
+
+
+class LazyCogs:
+    """Stands in for cogs that are only loaded when first used.
+
+    Each cog in the manifest gets stub prefix commands and event listeners
+    that load it, then invoke the real command or the cog's own listeners
+    for the event that triggered the load.
+    """
+
+    def __init__(self, heleus, load):
+        self.heleus = heleus
+        self.load = load  # coroutine function loading an extension
+        self.manifest = {}
+        self.stubs = {}  # extension -> (commands, (event, listener))
+        self._locks = {}
+        self.reload_manifest()
+
+    def reload_manifest(self):
+        manifest = yaml.get_safe('cogs', MANIFEST_SCHEMA)
+        self.manifest = manifest.get('lazy', {}) if manifest else {}
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def stub(self, name):
+        """Registers stubs for a cog, unless it's loaded or stubbed."""
+        if name in self.stubs or name in self.heleus.extensions:
+            return
+        entry = self.manifest[name]
+        stubs = []
+        for command in entry.get('commands', []):
+            if self.heleus.get_command(command) is not None:
+                logger.warning(
+                    f'Not stubbing the command {command} for {name}, the '
+                    'name is already in use.'
+                )
+                continue
+            stub = self._command_stub(name, command)
+            self.heleus.add_command(stub)
+            stubs.append(stub)
+        listeners = []
+        for event in entry.get('events', []):
+            listener = self._listener_stub(name, event)
+            self.heleus.add_listener(listener, f'on_{event}')
+            listeners.append((event, listener))
+        self.stubs[name] = (stubs, listeners)
+
+    def unstub(self, name):
+        stubs, listeners = self.stubs.pop(name, ((), ()))
+        for stub in stubs:
+            # leave the cog's own command alone, if it's been loaded since
+            if self.heleus.all_commands.get(stub.name) is stub:
+                self.heleus.remove_command(stub.name)
+        for event, listener in listeners:
+            self.heleus.remove_listener(listener, f'on_{event}')
+
+    async def resolve(self, name):
+        """Loads a stubbed cog, returning whether it's now loaded."""
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self.heleus.extensions:
+                self.unstub(name)
+                return True
+            if name not in self.stubs:
+                return False
+            self.unstub(name)
+            # noinspection PyBroadException
+            try:
+                await self.load(name)
+            except Exception:
+                logger.exception(f'Unable to load {name} on first use.')
+                self.stub(name)
+                return False
+            logger.info(f'Loaded {name} on first use.')
+            return True
+
+    async def prepare(self, ctx):
+        """Loads the cog behind a stub command, returning a new context.
+
+        Call this before invoking, as invoking the stub itself would
+        dispatch on_command for both the stub and the real command.
+        """
+        if ctx.command is None:
+            return ctx
+        name = ctx.command.extras.get('lazy_extension')
+        if name is None or not await self.resolve(name):
+            return ctx
+        return await self.heleus.get_context(ctx.message)
+
+    def _command_stub(self, name, command):
+        async def callback(ctx):
+            # only reached if the cog couldn't be loaded by prepare
+            await ctx.send('That command is unavailable.')
+
+        return commands.Command(
+            callback,
+            name=command,
+            help=f'Loads {name}, then runs this command.',
+            ignore_extra=True,
+            extras={'lazy_extension': name},
+        )
+
+    def _listener_stub(self, name, event):
+        async def listener(*args, **kwargs):
+            if not await self.resolve(name):
+                return
+            for cog in list(self.heleus.cogs.values()):
+                module = type(cog).__module__
+                if module != name and not module.startswith(f'{name}.'):
+                    continue
+                for listener_name, func in cog.get_listeners():
+                    if listener_name == f'on_{event}':
+                        await func(*args, **kwargs)
+
+        listener.__name__ = f'on_{event}'
+        return listener
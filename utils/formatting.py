@@ -1,9 +1,37 @@
+import functools
 import unicodedata
-from disnake import ApplicationCommandType
+from disnake import ApplicationCommandType, OptionType
 from disnake.ext import commands
 from disnake.utils import format_dt
 
 
+ZERO_WIDTH = '\ufeff\u200d\u200c\u200b'
+_ZERO_WIDTH_TABLE = str.maketrans('', '', ZERO_WIDTH)
+
+
+# combining marks (Mn and Me) are only assigned in the BMP, the SMP and
+# plane 14, so only those are scanned rather than every code point
+_MARK_PLANES = (range(0x20000), range(0xE0000, 0xF0000))
+# maps every combining mark to None, for str.translate, built at import so
+# that the first message with one doesn't stall the event loop
+_COMBINING_TABLE = dict.fromkeys(
+    i
+    for plane in _MARK_PLANES
+    for i in plane
+    if unicodedata.category(chr(i)) in ('Mn', 'Me')
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _sanitize_table(zerowidth: bool, zalgo: bool) -> dict:
+    table = {}
+    if zalgo:
+        table.update(_COMBINING_TABLE)
+    if zerowidth:
+        table.update(_ZERO_WIDTH_TABLE)
+    return table
+
+
 def strip_zerowidth(text: str) -> str:
     """Strips known zero-width characters from text.
     Parameters
@@ -15,9 +43,9 @@ def strip_zerowidth(text: str) -> str:
     str
         The stripped text.
     """
-    for c in ['\ufeff', '\u200d', '\u200c', '\u200b']:
-        text = text.replace(c, '')
-    return text
+    if text.isascii():
+        return text
+    return text.translate(_ZERO_WIDTH_TABLE)
 
 
 def strip_zalgo(text: str) -> str:
@@ -31,13 +59,82 @@ def strip_zalgo(text: str) -> str:
     str
         The stripped text.
     """
-    return ''.join(
-        [
-            c
-            for c in unicodedata.normalize('NFD', text)
-            if unicodedata.category(c) not in ['Mn', 'Me']
-        ]
-    )
+    if text.isascii():
+        return text
+    return unicodedata.normalize('NFD', text).translate(_COMBINING_TABLE)
+
+
+class Sanitizer:
+    """Strips zero-width characters and zalgo from text in one pass.
+
+    ASCII text, which can contain neither, is returned as is. Set
+    `cache_size` to keep the results for recently seen strings, for text
+    that repeats a lot such as spam.
+    """
+
+    def __init__(
+        self, zerowidth: bool = True, zalgo: bool = True, cache_size: int = 0
+    ):
+        self.zerowidth = zerowidth
+        self.zalgo = zalgo
+        self.cache_size = cache_size
+        if cache_size:
+            self._sanitize = functools.lru_cache(maxsize=cache_size)(
+                self._sanitize
+            )
+
+    def _sanitize(self, text: str) -> str:
+        if text.isascii():
+            return text
+        if self.zalgo:
+            text = unicodedata.normalize('NFD', text)
+        return text.translate(_sanitize_table(self.zerowidth, self.zalgo))
+
+    def __call__(self, text: str) -> str:
+        return self._sanitize(text)
+
+    def many(self, texts) -> list:
+        """Sanitizes several strings."""
+        sanitize = self._sanitize
+        return [sanitize(x) for x in texts]
+
+    def cache_info(self):
+        if not self.cache_size:
+            return None
+        return self._sanitize.cache_info()
+
+
+_sanitizers = {}
+
+
+def _sanitizer(zerowidth, zalgo) -> Sanitizer:
+    key = (zerowidth, zalgo)
+    if key not in _sanitizers:
+        _sanitizers[key] = Sanitizer(zerowidth, zalgo)
+    return _sanitizers[key]
+
+
+def sanitize(text: str, zerowidth: bool = True, zalgo: bool = True) -> str:
+    """Strips zero-width characters and zalgo from text.
+    Parameters
+    ----------
+    text : str
+        The text to be sanitized.
+    zerowidth : bool
+        Whether to strip zero-width characters, as strip_zerowidth does.
+    zalgo : bool
+        Whether to strip zalgo, as strip_zalgo does.
+    Returns
+    -------
+    str
+        The sanitized text.
+    """
+    return _sanitizer(zerowidth, zalgo)(text)
+
+
+def sanitize_many(texts, zerowidth: bool = True, zalgo: bool = True) -> list:
+    """Sanitizes several strings, see sanitize."""
+    return _sanitizer(zerowidth, zalgo).many(texts)
 
 
 def format_time(time):
@@ -69,18 +166,80 @@ def strfdelta(delta):
     return ' '.join(s)
 
 
+def _subcommand_paths(name, options):
+    """Yields the paths to a slash command's subcommands and groups."""
+    for option in options or []:
+        if option.type not in (
+            OptionType.sub_command,
+            OptionType.sub_command_group,
+        ):
+            continue
+        path = f'{name} {option.name}'
+        yield path
+        yield from _subcommand_paths(path, option.options)
+
+
 class CommandFormatter:
+    """Formats slash command names as mentions.
+
+    Command names, including subcommand paths, are indexed once per
+    command sync, or when the cached commands change, rather than looked up
+    on every call.
+    """
+
     def __init__(self, heleus: commands.Bot):
         self.heleus = heleus
+        self._index = {}  # name or subcommand path -> command ID
+        self._indexed = None  # the state the index was built from
 
-    def format(self, name: str):
-        parent = name.split(' ')[0]
-        command = self.heleus.get_global_command_named(
-            parent, ApplicationCommandType.chat_input
+    def _build_index(self):
+        ids = dict(getattr(self.heleus, 'command_ids', {}))
+        options = {}
+        for command in self.heleus.global_application_commands:
+            if (
+                command.type == ApplicationCommandType.chat_input
+                and command.application_id == self.heleus.application_id
+            ):
+                ids[command.name] = command.id
+                options[command.name] = command.options
+        index = {}
+        for name, command_id in ids.items():
+            index[name] = command_id
+            if name not in options:
+                # processes that didn't sync only know the local definitions
+                local = self.heleus.get_slash_command(name)
+                options[name] = local.body.options if local else []
+            for path in _subcommand_paths(name, options[name]):
+                index[path] = command_id
+        return index
+
+    @property
+    def index(self) -> dict:
+        synced = getattr(self.heleus, 'command_sync_count', None)
+        # processes that don't sync only see the commands being cached
+        state = (
+            synced,
+            len(self.heleus.global_application_commands),
+            id(getattr(self.heleus, 'command_ids', None)),
         )
-        if not command:
-            return f'`/{name}`'
-        if command.application_id != self.heleus.application_id:
+        if synced is None or state != self._indexed:
+            self._index = self._build_index()
+            self._indexed = state
+        return self._index
+
+    def format(self, name: str):
+        return self._format(self.index, name)
+
+    @staticmethod
+    def _format(index, name):
+        command_id = index.get(name)
+        if command_id is None:
+            command_id = index.get(name.split(' ')[0])
+        if command_id is None:
             return f'`/{name}`'
-        if command:
-            return f'</{name}:{command.id}>'
+        return f'</{name}:{command_id}>'
+
+    def format_many(self, names) -> list:
+        """Formats several command names, looking the index up once."""
+        index = self.index
+        return [self._format(index, x) for x in names]
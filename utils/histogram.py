@@ -0,0 +1,63 @@
+import typing
+
+SUB_BUCKET_BITS = 5  # 32 buckets per power of two, within ~3% of the value
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value: int) -> int:
+    """Returns the bucket a (non-negative integer) value is counted in."""
+    shift = max(value.bit_length() - 1 - SUB_BUCKET_BITS, 0)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index: int) -> float:
+    """Returns the midpoint of the values counted in a bucket."""
+    shift = max(index // SUB_BUCKETS - 1, 0)
+    lower = (index - shift * SUB_BUCKETS) << shift
+    return lower + ((1 << shift) - 1) / 2
+
+
+class LatencyHistogram:
+    """A compact, mergeable log-linear histogram in the style of HdrHistogram.
+
+    Values are recorded in microseconds and only buckets that have been
+    used are stored, so a histogram is a small dict of bucket counts that
+    can be summed across processes, e.g. with Redis' HINCRBY.
+    """
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self, counts=None):
+        self.counts = {}
+        self.total = 0
+        if counts:
+            self.merge(counts)
+
+    def __len__(self):
+        return self.total
+
+    def record(self, seconds: float):
+        index = bucket_index(max(int(seconds * 1_000_000), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+
+    def merge(self, counts: typing.Mapping[int, int]):
+        """Adds bucket counts from another histogram."""
+        if isinstance(counts, LatencyHistogram):
+            counts = counts.counts
+        for index, count in counts.items():
+            index, count = int(index), int(count)
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.total += count
+
+    def percentile(self, percentile: float) -> float:
+        """Returns the latency at a percentile (0-100), in seconds."""
+        if not self.total:
+            return 0.0
+        target = self.total * percentile / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return bucket_value(index) / 1_000_000
+        return bucket_value(max(self.counts)) / 1_000_000
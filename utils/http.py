@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('heleus')
+
+MAX_BODY = 64 * 1024  # bytes, larger requests are refused
+
+_reasons = {
+    200: 'OK',
+    400: 'Bad Request',
+    413: 'Content Too Large',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+async def _respond(writer, status, content_type, body):
+    head = (
+        f'HTTP/1.1 {status} {_reasons.get(status, "Unknown")}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        'Connection: close\r\n\r\n'
+    )
+    writer.write(head.encode() + body)
+    await writer.drain()
+
+
+async def _handle(routes, reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=10)
+        parts = request.decode('latin-1').split()
+        if len(parts) != 3:
+            return await _respond(writer, 400, 'text/plain', b'bad request')
+        method, path, _ = parts
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = b''
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY:
+            return await _respond(writer, 413, 'text/plain', b'too large')
+        if length:
+            body = await asyncio.wait_for(
+                reader.readexactly(length), timeout=10
+            )
+        handler = routes.get(path.split('?', 1)[0])
+        if handler is None:
+            return await _respond(writer, 404, 'text/plain', b'not found')
+        # noinspection PyBroadException
+        try:
+            status, content_type, response = await handler(
+                method, headers, body
+            )
+        except Exception:
+            logger.exception(f'Exception in HTTP handler for {path}.')
+            return await _respond(writer, 500, 'text/plain', b'error')
+        await _respond(writer, status, content_type, response)
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(routes, host, port) -> asyncio.AbstractServer:
+    """Starts a minimal HTTP/1.1 server on the running event loop.
+
+    - routes: A mapping of paths to coroutine functions taking the method,
+      headers and body, and returning (status, content type, body bytes)
+    - host: The host to bind to
+    - port: The port to bind to
+
+    Meant for small internal endpoints such as metrics scraping, every
+    connection is closed after a single response.
+    """
+
+    async def handle(reader, writer):
+        await _handle(routes, reader, writer)
+
+    return await asyncio.start_server(handle, host, port)
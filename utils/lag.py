@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger('heleus')
+
+
+class LagMonitor:
+    """Measures event loop lag by timing how late a periodic callback runs.
+
+    The callback is a plain ``call_later`` handle rather than a task, so
+    measuring costs one timer per interval.
+    """
+
+    def __init__(self, loop, interval=0.25):
+        self.loop = loop
+        self.interval = interval
+        self.lag = 0.0  # the latest measurement, in seconds
+        self.average = 0.0  # exponentially weighted
+        self.max_lag = 0.0
+        self.last_tick = None  # loop.time() of the latest tick
+        # time.monotonic() of the latest tick, stamped on the loop's thread
+        # for other threads, as loop.time() may use a different clock
+        self.last_stamp = None
+        self._expected = None
+        self._handle = None
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self):
+        if self._handle is not None:
+            return
+        self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        self.last_tick = self.loop.time()
+        self.last_stamp = time.monotonic()
+        self._expected = self.last_tick + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        lag = max(self.loop.time() - self._expected, 0.0)
+        self.lag = lag
+        self.average += (lag - self.average) * 0.2
+        if lag > self.max_lag:
+            self.max_lag = lag
+        self._schedule()
+
+
+class SlowCallback:
+    """A record of the event loop being blocked."""
+
+    __slots__ = ('duration', 'when', 'task', 'coroutine', 'cog', 'stack')
+
+    def __init__(self, duration, when, task, coroutine, cog, stack):
+        self.duration = duration
+        self.when = when
+        self.task = task
+        self.coroutine = coroutine
+        self.cog = cog
+        self.stack = stack
+
+    def to_dict(self):
+        return {x: getattr(self, x) for x in self.__slots__}
+
+
+def _describe(frames):
+    """Finds the innermost coroutine and cog in a list of frames."""
+    coroutine = None
+    cog = None
+    cogs = os.path.join(os.getcwd(), 'cogs') + os.sep
+    for frame in reversed(frames):
+        code = frame.f_code
+        if coroutine is None and code.co_flags & inspect.CO_COROUTINE:
+            coroutine = code.co_qualname
+        if cog is None and code.co_filename.startswith(cogs):
+            cog = frame.f_globals.get('__name__')
+        if coroutine is not None and cog is not None:
+            break
+    return coroutine, cog
+
+
+class SlowCallbackMonitor:
+    """Reports callbacks and task steps that block the event loop.
+
+    A watcher thread checks how long ago the LagMonitor's timer last ran.
+    Once that is later than the threshold, it samples the loop thread's
+    stack so the offending coroutine and cog can be reported when the loop
+    recovers. The worst offenders are kept for the `stats lag` command.
+    """
+
+    def __init__(self, lag_monitor, threshold=0.1, keep=20):
+        self.lag_monitor = lag_monitor
+        self.threshold = threshold
+        self.keep = keep
+        self.count = 0
+        self._worst = []  # min-heap of (duration, sequence, SlowCallback)
+        self._sequence = itertools.count()
+        self._loop_thread = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def worst(self):
+        return [x[2] for x in sorted(self._worst, reverse=True)]
+
+    def start(self):
+        """Starts watching, must be called from the event loop's thread."""
+        if self._thread is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._thread = threading.Thread(
+            name='slow callback monitor', target=self._watch, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return (None, None, None), []
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        task = None
+        try:
+            task = asyncio.current_task(self.lag_monitor.loop)
+        except RuntimeError:
+            pass
+        coroutine, cog = _describe(frames)
+        if task is not None:
+            coroutine = coroutine or task.get_coro().__qualname__
+            task = task.get_name()
+        stack = traceback.format_list(
+            traceback.StackSummary.extract(
+                (f, f.f_lineno) for f in frames[-20:]
+            )
+        )
+        return (task, coroutine, cog), stack
+
+    def _watch(self):
+        monitor = self.lag_monitor
+        poll = min(self.threshold / 2, 0.05)
+        sample = None
+        stall_tick = None
+        while not self._stopped.wait(poll):
+            last_tick = monitor.last_stamp
+            if last_tick is None:
+                continue
+            late = time.monotonic() - last_tick - monitor.interval
+            if sample is None and late > self.threshold:
+                stall_tick = last_tick
+                sample = self._sample()
+            elif sample is not None and last_tick != stall_tick:
+                self._record(monitor.lag, *sample)
+                sample = None
+
+    def _record(self, duration, details, stack):
+        task, coroutine, cog = details
+        record = SlowCallback(
+            duration, time.time(), task, coroutine, cog, ''.join(stack)
+        )
+        self.count += 1
+        logger.warning(
+            f'The event loop was blocked for {duration * 1000:.0f} ms by '
+            f'{coroutine or "an unknown callback"}'
+            f'{f" in {cog}" if cog else ""} (task {task}):\n{record.stack}'
+        )
+        entry = (duration, next(self._sequence), record)
+        if len(self._worst) < self.keep:
+            heapq.heappush(self._worst, entry)
+        else:
+            heapq.heappushpop(self._worst, entry)
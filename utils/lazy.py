@@ -0,0 +1,86 @@
+import importlib
+import importlib.util
+import subprocess
+import sys
+import threading
+
+
+class LazyModule:
+    """A module that's only imported when one of its attributes is used.
+
+    Unlike importlib's LazyLoader this is safe to use from several threads
+    at once, such as the event loop and the pubsub thread.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, item):
+        return getattr(self.__load(), item)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_LazyModule__'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.__load(), name, value)
+
+    def __dir__(self):
+        return dir(self.__load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__module is not None else 'not loaded'
+        return f'<lazy module {self.__name!r} ({state})>'
+
+
+def lazy_import(name):
+    """Returns a module to be imported on first use.
+
+    The module is only located up front, so a missing dependency still
+    raises ImportError at the usual place.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    return LazyModule(name)
+
+
+def import_times(*modules, top=15):
+    """Imports modules in a fresh interpreter with -X importtime.
+
+    Returns the total time the modules took, and the slowest modules they
+    import directly as (name, seconds) pairs.
+    """
+    code = ';'.join(f'import {x}' for x in modules)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+    )
+    total = 0.0
+    children = []
+    # each line is "import time: self | cumulative | name", with the
+    # names indented by two spaces per level of nesting
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:') :].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        seconds = int(cumulative) / 1_000_000
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() in modules:
+            total += seconds
+        elif depth == 1:
+            children.append((name.strip(), seconds))
+    return total, sorted(children, key=lambda x: -x[1])[:top]
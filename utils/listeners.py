@@ -0,0 +1,83 @@
+import functools
+import time
+
+from disnake.ext import commands
+
+
+class ListenerStats:
+    """Call counts and timings for one cog's listeners of one event."""
+
+    __slots__ = ('cog', 'event', 'calls', 'sampled', 'time', 'errors')
+
+    def __init__(self, cog, event):
+        self.cog = cog
+        self.event = event
+        self.calls = 0
+        self.sampled = 0  # calls that were timed
+        self.time = 0.0  # wall time of the timed calls
+        self.errors = 0
+
+    @property
+    def estimated_time(self):
+        """The wall time of all calls, extrapolated from the timed ones."""
+        if not self.sampled:
+            return 0.0
+        return self.time * self.calls / self.sampled
+
+
+def _owner(func):
+    owner = getattr(func, '__self__', None)
+    if isinstance(owner, commands.Cog):
+        return owner.qualified_name
+    if owner is not None:
+        return type(owner).__name__
+    return getattr(func, '__module__', None) or '-'
+
+
+class ListenerProfiler:
+    """Wraps event listeners to account their calls per (cog, event).
+
+    Every call is counted, and one in every ``1 / sample_rate`` calls is
+    timed, so the overhead can be kept low enough for production.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        self.every = max(int(round(1 / sample_rate)), 1)
+        self.stats = {}
+        self._wrappers = {}
+
+    def wrap(self, func, event):
+        key = (event, func)
+        if key in self._wrappers:
+            return self._wrappers[key]
+        owner = _owner(func)
+        stats = self.stats.get((owner, event))
+        if stats is None:
+            stats = self.stats[(owner, event)] = ListenerStats(owner, event)
+        every = self.every
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            stats.calls += 1
+            if stats.calls % every:
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    stats.errors += 1
+                    raise
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.sampled += 1
+                stats.time += time.perf_counter() - start
+
+        self._wrappers[key] = wrapper
+        return wrapper
+
+    def unwrap(self, func, event):
+        """Returns the wrapper registered for a listener, forgetting it."""
+        return self._wrappers.pop((event, func), func)
@@ -0,0 +1,262 @@
+import atexit
+import bz2
+import collections
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+from utils import metrics
+
+
+class ContextFilter(logging.Filter):
+    """Adds the shard and instance IDs to every record."""
+
+    def __init__(self, shard_id=None, instance_id=None):
+        super().__init__()
+        self.shard_id = shard_id
+        self.instance_id = instance_id
+
+    def filter(self, record):
+        record.shard_id = self.shard_id
+        record.instance_id = self.instance_id
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as JSON lines, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'shard_id': getattr(record, 'shard_id', None),
+            'instance_id': getattr(record, 'instance_id', None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking when full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = collections.Counter()  # level name -> records
+
+    def prepare(self, record):
+        # the message and traceback are rendered here, as arguments may
+        # change after being queued, but the rest is left for formatters
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped[record.levelname] += 1
+
+
+class LogCompressor:
+    """Compresses log files into an archive directory on a thread.
+
+    Files are streamed through bz2 in chunks, so they're never read into
+    memory whole. After each file, the oldest archives are removed until
+    the archive fits the retention limits.
+    """
+
+    def __init__(self, archive, max_age=None, max_bytes=None):
+        self.archive = archive
+        self.max_age = max_age  # seconds
+        self.max_bytes = max_bytes
+        self.compressed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            name='log compressor', target=self._run, daemon=True
+        )
+        os.makedirs(archive, exist_ok=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, path):
+        self._queue.put(path)
+
+    def stop(self):
+        """Finishes compressing the files that were already submitted."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            # noinspection PyBroadException
+            try:
+                self.compress(path)
+                self.prune()
+            except Exception:
+                logging.getLogger('heleus').exception(
+                    f'Unable to compress {path}.'
+                )
+
+    def compress(self, path):
+        destination = os.path.join(
+            self.archive, os.path.basename(path) + '.bz2'
+        )
+        with open(path, 'rb') as src, bz2.open(destination, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024**2)
+        os.remove(path)
+        self.compressed += 1
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.archive):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()  # oldest first
+        total = sum(x[1] for x in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            expired = self.max_age and now - mtime > self.max_age
+            oversized = self.max_bytes and total > self.max_bytes
+            if not (expired or oversized):
+                break
+            os.remove(path)
+            total -= size
+
+
+class RotatingLogHandler(logging.handlers.BaseRotatingHandler):
+    """A file handler rotating once a file is too large or too old.
+
+    Rotated files are renamed with the time they were rotated, then
+    handed to a LogCompressor rather than compressed in place.
+    """
+
+    def __init__(self, filename, compressor, max_bytes=0, interval=0):
+        super().__init__(filename, 'a', encoding='utf-8', delay=False)
+        self.compressor = compressor
+        self.max_bytes = max_bytes
+        self.interval = interval  # seconds
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name):
+        base, extension = os.path.splitext(self.baseFilename)
+        now = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        name = f'{base}.{now}{extension}'
+        count = 1
+        while os.path.exists(name):
+            count += 1
+            name = f'{base}.{now}.{count}{extension}'
+        return name
+
+    def rotate(self, source, dest):
+        os.rename(source, dest)
+        self.compressor.submit(dest)
+
+    def doRollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.rotate(
+            self.baseFilename, self.rotation_filename(self.baseFilename)
+        )
+        self.stream = self._open()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room rather than failing to stop when the queue is full
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Moves log handlers off the logging threads onto a listener thread.
+
+    Loggers only put records on a bounded queue, and a QueueListener
+    thread does the formatting and disk and stdout writes. Records are
+    dropped and counted when the queue overflows, rather than blocking
+    the event loop.
+    """
+
+    def __init__(self, max_size=10000, context=None):
+        self.queue = queue.Queue(max_size)
+        self.context = context or ContextFilter()
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.context)
+        self.handlers = []
+        self.listener = None
+        metrics.Counter(
+            'heleus_log_records_dropped',
+            'Log records dropped because the log queue was full.',
+            labels=('level',),
+            callback=lambda: [
+                ((k,), v) for k, v in self.handler.dropped.items()
+            ],
+        )
+        metrics.Gauge(
+            'heleus_log_queue_depth',
+            'Log records waiting to be written.',
+            callback=self.queue.qsize,
+        )
+
+    @property
+    def dropped(self):
+        return sum(self.handler.dropped.values())
+
+    def add_handler(self, handler, *loggers):
+        """Adds a handler, only for records from the given loggers if any."""
+        if loggers:
+            handler.addFilter(
+                lambda r: any(
+                    r.name == x or r.name.startswith(x + '.') for x in loggers
+                )
+            )
+        self.handlers.append(handler)
+
+    def attach(self, logger):
+        logger.addHandler(self.handler)
+
+    def start(self):
+        self.listener = _QueueListener(
+            self.queue, *self.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Writes out queued records and stops the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
@@ -0,0 +1,206 @@
+import collections
+import itertools
+import random
+import re
+import sys
+
+import disnake as discord
+from disnake.state import ConnectionState
+
+# Rough per-object costs used when planning a cache policy. These are
+# deliberately pessimistic averages for a typical bot, the `stats cache`
+# command measures the real figures on a running shard.
+# interpreter, disnake, cogs and connection state overhead
+BASELINE_BYTES = 192 * 1024**2
+MESSAGE_BYTES = 4 * 1024  # a full Message with its author, embeds, etc.
+COMPACT_MESSAGE_BYTES = 512  # a CachedMessage from utils.message_cache
+MESSAGE_SHARE = 0.15  # share of the budget handed to the message cache
+MAX_MESSAGES = 250_000
+
+_units = {
+    '': 1,
+    'b': 1,
+    'k': 1000,
+    'kb': 1000,
+    'kib': 1024,
+    'm': 1000**2,
+    'mb': 1000**2,
+    'mib': 1024**2,
+    'g': 1000**3,
+    'gb': 1000**3,
+    'gib': 1024**3,
+}
+_size_re = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*$', re.IGNORECASE)
+
+
+def parse_size(value: str) -> int:
+    """Parses a human readable size such as ``1GiB`` or ``512M`` into bytes.
+
+    Raises ValueError if the size can't be parsed.
+    """
+    match = _size_re.match(str(value))
+    if match is None or match.group(2).lower() not in _units:
+        raise ValueError(f'invalid size: {value!r}')
+    return int(float(match.group(1)) * _units[match.group(2).lower()])
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size:.0f} B'
+        size /= 1024
+    return f'{size:.2f} GiB'
+
+
+class CachePolicy:
+    """The cache settings picked for a given memory budget."""
+
+    __slots__ = (
+        'budget',
+        'tier',
+        'member_cache_flags',
+        'chunk_guilds_at_startup',
+        'max_messages',
+        'compact_messages',
+    )
+
+    def __init__(
+        self,
+        budget,
+        tier,
+        member_cache_flags,
+        chunk_guilds_at_startup,
+        max_messages,
+    ):
+        self.budget = budget
+        self.tier = tier
+        self.member_cache_flags = member_cache_flags
+        self.chunk_guilds_at_startup = chunk_guilds_at_startup
+        self.max_messages = max_messages
+        self.compact_messages = (
+            (max_messages or 0) * MESSAGE_BYTES // COMPACT_MESSAGE_BYTES
+        )
+
+    def to_kwargs(self) -> dict:
+        """Returns the policy as keyword arguments for the bot."""
+        return {
+            'member_cache_flags': self.member_cache_flags,
+            'chunk_guilds_at_startup': self.chunk_guilds_at_startup,
+            'max_messages': self.max_messages,
+        }
+
+    def __repr__(self):
+        return (
+            f'<CachePolicy tier={self.tier!r} budget={format_size(self.budget)!r} '
+            f'joined_members={self.member_cache_flags.joined} '
+            f'chunking={self.chunk_guilds_at_startup} max_messages={self.max_messages}>'
+        )
+
+
+def plan_cache_policy(budget: int, intents: discord.Intents) -> CachePolicy:
+    """Picks member caching, chunking and message cache size for a budget.
+
+    - budget: The per-shard memory target in bytes
+    - intents: The Gateway Intents the bot will connect with
+
+    Budgets under 512 MiB (after the baseline) only cache members that are
+    in voice, budgets under 2 GiB cache members as they are seen, and
+    anything larger chunks every guild on startup.
+    """
+    available = max(budget - BASELINE_BYTES, 0)
+    flags = discord.MemberCacheFlags.from_intents(intents)
+    if available <= 512 * 1024**2:
+        tier = 'minimal'
+        flags.joined = False
+        chunk = False
+    elif available <= 2 * 1024**3:
+        tier = 'partial'
+        chunk = False
+    else:
+        tier = 'full'
+        chunk = intents.members
+    messages = min(
+        int(available * MESSAGE_SHARE) // MESSAGE_BYTES, MAX_MESSAGES
+    )
+    return CachePolicy(budget, tier, flags, chunk, messages or None)
+
+
+_atomic = (str, bytes, int, float, bool, complex, type(None))
+
+
+def _sizeof(obj, seen, depth=0):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, _atomic) or depth > 6:
+        return size
+    # other models live in their own caches, so don't count them twice
+    if isinstance(obj, ConnectionState) or (depth and hasattr(obj, '_state')):
+        return 0
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _sizeof(key, seen, depth + 1)
+            size += _sizeof(value, seen, depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        for item in obj:
+            size += _sizeof(item, seen, depth + 1)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += _sizeof(vars(obj), seen, depth + 1)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if slot in ('__dict__', '__weakref__'):
+                    continue
+                try:
+                    size += _sizeof(getattr(obj, slot), seen, depth + 1)
+                except AttributeError:
+                    pass
+    return size
+
+
+def estimate_bytes(objects, count=None, sample=64) -> int:
+    """Estimates the memory used by a collection of cached objects.
+
+    A random sample of the objects is measured and scaled up to the total
+    count, references to other cached models are not followed.
+    """
+    objects = list(objects)
+    if count is None:
+        count = len(objects)
+    if not objects:
+        return 0
+    if len(objects) > sample:
+        objects = random.sample(objects, sample)
+    seen = set()
+    total = sum(_sizeof(x, seen) for x in objects)
+    return int(total / len(objects) * count)
+
+
+def cache_stats(heleus) -> list:
+    """Returns (cache, objects, estimated bytes) for each of Heleus' caches."""
+    guilds = heleus.guilds
+    members = sum(len(g._members) for g in guilds)
+    sampled = random.sample(guilds, min(len(guilds), 16))
+    member_sample = [
+        m for g in sampled for m in itertools.islice(g._members.values(), 8)
+    ]
+    users = heleus.users
+    messages = heleus.cached_messages
+    stats = [
+        ('guilds', len(guilds), estimate_bytes(guilds)),
+        ('members', members, estimate_bytes(member_sample, members)),
+        ('users', len(users), estimate_bytes(users)),
+        ('messages', len(messages), estimate_bytes(messages)),
+    ]
+    if heleus.message_cache is not None:
+        cache = heleus.message_cache
+        sample = itertools.islice(reversed(cache._messages.values()), 64)
+        stats.append(
+            (
+                'compact messages',
+                len(cache),
+                estimate_bytes(sample, len(cache)),
+            )
+        )
+    return stats
@@ -0,0 +1,152 @@
+import collections
+import itertools
+import typing
+
+from disnake.utils import parse_time, snowflake_time
+
+
+class CachedMessage:
+    """A slim record of a message, kept by Heleus' compact message cache."""
+
+    __slots__ = (
+        'id',
+        'channel_id',
+        'guild_id',
+        'author_id',
+        'content',
+        'edited_at',
+        'deleted',
+    )
+
+    def __init__(
+        self, id, channel_id, guild_id, author_id, content, edited_at=None
+    ):
+        self.id = id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.content = content
+        self.edited_at = edited_at
+        self.deleted = False
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message.id,
+            message.channel.id,
+            message.guild.id if message.guild else None,
+            message.author.id,
+            message.content,
+            message.edited_at,
+        )
+
+    @property
+    def created_at(self):
+        return snowflake_time(self.id)
+
+    def __repr__(self):
+        return (
+            f'<CachedMessage id={self.id} channel_id={self.channel_id} '
+            f'author_id={self.author_id} deleted={self.deleted}>'
+        )
+
+
+class MessageCache:
+    """A message cache bounded per channel as well as globally.
+
+    Busy channels can only push out their own history, so quieter channels
+    keep theirs. Deleted messages are flagged rather than removed so that
+    delete listeners can still look them up, they age out like any other.
+    """
+
+    def __init__(self, max_messages=5000, per_channel=100):
+        self.max_messages = max_messages
+        self.per_channel = per_channel
+        self.hits = 0
+        self.misses = 0
+        self._messages = collections.OrderedDict()
+        self._channels = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __contains__(self, message_id):
+        return message_id in self._messages
+
+    def __iter__(self):
+        return iter(self._messages.values())
+
+    def add(self, message):
+        """Adds a Message to the cache."""
+        record = CachedMessage.from_message(message)
+        channel = self._channels.get(record.channel_id)
+        if channel is None:
+            channel = collections.OrderedDict()
+            self._channels[record.channel_id] = channel
+        channel[record.id] = record
+        self._messages[record.id] = record
+        if len(channel) > self.per_channel:
+            oldest, _ = channel.popitem(last=False)
+            self._messages.pop(oldest, None)
+        if len(self._messages) > self.max_messages:
+            _, oldest = self._messages.popitem(last=False)
+            self._remove_from_channel(oldest)
+        return record
+
+    def _remove_from_channel(self, record):
+        channel = self._channels.get(record.channel_id)
+        if channel is None:
+            return
+        channel.pop(record.id, None)
+        if not channel:
+            del self._channels[record.channel_id]
+
+    def get(self, message_id) -> typing.Optional[CachedMessage]:
+        """Gets a cached message by its ID."""
+        record = self._messages.get(message_id)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def history(self, channel_id, limit=None) -> typing.List[CachedMessage]:
+        """Lists a channel's cached messages, newest first."""
+        channel = self._channels.get(channel_id)
+        if not channel:
+            return []
+        records = reversed(channel.values())
+        if limit is None:
+            return list(records)
+        return list(itertools.islice(records, limit))
+
+    def pop(self, message_id) -> typing.Optional[CachedMessage]:
+        """Removes a message from the cache, returning it if it was cached."""
+        record = self._messages.pop(message_id, None)
+        if record is not None:
+            self._remove_from_channel(record)
+        return record
+
+    def remove_channel(self, channel_id):
+        """Drops all cached messages for a channel."""
+        for message_id in self._channels.pop(channel_id, {}):
+            self._messages.pop(message_id, None)
+
+    def update(self, payload):
+        """Applies a RawMessageUpdateEvent to the cache."""
+        record = self._messages.get(payload.message_id)
+        if record is None:
+            return None
+        if 'content' in payload.data:
+            record.content = payload.data['content']
+        edited_at = payload.data.get('edited_timestamp')
+        if edited_at:
+            record.edited_at = parse_time(edited_at)
+        return record
+
+    def mark_deleted(self, message_ids):
+        """Flags messages as deleted."""
+        for message_id in message_ids:
+            record = self._messages.get(message_id)
+            if record is not None:
+                record.deleted = True
@@ -0,0 +1,218 @@
+import bisect
+import math
+import time
+
+# Histogram buckets, in seconds, used unless a metric picks its own
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """The base for all metrics.
+
+    A callback returning the value, or an iterable of (labels, value) pairs
+    for labelled metrics, can be given instead of updating the metric so
+    that it's only computed when scraped.
+    """
+
+    type = 'unknown'
+
+    def __init__(
+        self, name, documentation, labels=(), registry=None, callback=None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.callback = callback
+        self._values = {}
+        if registry is None:
+            registry = default_registry
+        if registry is not False:
+            registry.register(self)
+
+    def header(self):
+        return [
+            f'# TYPE {self.name} {self.type}',
+            f'# HELP {self.name} {_escape(self.documentation)}',
+        ]
+
+    def items(self):
+        if self.callback is None:
+            return list(self._values.items())
+        values = self.callback()
+        if not self.label_names:
+            return [((), values)]
+        return values
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        return self.header() + list(self.samples())
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    type = 'counter'
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self.items():
+            label = _labels(self.label_names, labels)
+            yield f'{self.name}_total{label} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        for labels, value in self.items():
+            label = _labels(self.label_names, labels)
+            yield f'{self.name}{label} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets."""
+
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labels=(),
+        registry=None,
+        buckets=DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # bucket counts (the last one being +Inf), then the sum
+            state = [0] * (len(self.buckets) + 1) + [0.0]
+            self._values[labels] = state
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        bounds = self.buckets + (math.inf,)
+        for labels, state in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                label = _labels(
+                    self.label_names, labels, ('le', _format_value(bound))
+                )
+                yield f'{self.name}_bucket{label} {cumulative}'
+            label = _labels(self.label_names, labels)
+            yield f'{self.name}_count{label} {cumulative}'
+            yield f'{self.name}_sum{label} {_format_value(state[-1])}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """A collection of metrics that can be rendered for scraping."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def unregister(self, name):
+        self.metrics.pop(name, None)
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        lines.append('# EOF')
+        return ('\n'.join(lines) + '\n').encode()
+
+
+default_registry = Registry()
+
+
+def get_or_create(cls, name, *args, **kwargs):
+    """Returns an already registered metric, or registers a new one.
+
+    Useful in cogs, which may be reloaded and would otherwise reset their
+    metrics or register duplicates.
+    """
+    metric = default_registry.get(name)
+    if metric is None:
+        metric = cls(name, *args, **kwargs)
+    return metric
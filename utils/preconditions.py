@@ -0,0 +1,231 @@
+import inspect
+import itertools
+import logging
+import time
+
+logger = logging.getLogger('heleus')
+
+
+class PreconditionList(list):
+    """A list of preconditions that counts its own modifications.
+
+    Used for Core's legacy ``global_preconditions`` lists so that the
+    pipeline knows when to recompile without rescanning them per message.
+    """
+
+    version = 0
+
+
+def _mutator(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        self.version += 1
+        return method(self, *args)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in (
+    'append',
+    'extend',
+    'insert',
+    'remove',
+    'pop',
+    'clear',
+    'sort',
+    'reverse',
+    '__setitem__',
+    '__delitem__',
+    '__iadd__',
+):
+    setattr(PreconditionList, _name, _mutator(_name))
+
+
+class Precondition:
+    """A registered precondition and its counters."""
+
+    __slots__ = (
+        'func',
+        'name',
+        'is_async',
+        'priority',
+        'guilds',
+        'override',
+        'order',
+        'calls',
+        'rejections',
+        'errors',
+        'time',
+    )
+
+    def __init__(self, func, is_async, priority, guilds, override, order):
+        self.func = func
+        self.name = getattr(func, '__name__', repr(func))
+        self.is_async = is_async  # None means we have to check the result
+        self.priority = priority
+        self.guilds = frozenset(guilds) if guilds is not None else None
+        self.override = override
+        self.order = order
+        self.calls = 0
+        self.rejections = 0
+        self.errors = 0
+        self.time = 0.0
+
+    def __repr__(self):
+        return (
+            f'<Precondition name={self.name!r} priority={self.priority} '
+            f'override={self.override} guilds={self.guilds}>'
+        )
+
+
+class PreconditionPipeline:
+    """Preconditions compiled into per-guild, priority ordered tuples.
+
+    Overrides let a message through to command processing as soon as one
+    returns True, preconditions stop it as soon as one returns False.
+    Higher priorities run first, and synchronous preconditions run before
+    asynchronous ones of the same priority.
+    """
+
+    def __init__(self, legacy=None, legacy_overrides=None):
+        self.legacy = legacy if legacy is not None else PreconditionList()
+        self.legacy_overrides = (
+            legacy_overrides
+            if legacy_overrides is not None
+            else PreconditionList()
+        )
+        self._registered = []
+        self._legacy_entries = {}
+        self._counter = itertools.count()
+        self._default = ()
+        self._by_guild = {}
+        self._dirty = True
+        self._versions = None
+
+    def register(
+        self, func, *, is_async=None, priority=0, guilds=None, override=False
+    ) -> Precondition:
+        """Registers a precondition.
+
+        - func: A callable taking the message
+        - is_async: Whether func returns an awaitable, detected if not given
+        - priority: Higher priorities run first
+        - guilds: An iterable of guild IDs to only run the precondition in
+        - override: Whether this is an override rather than a precondition
+        """
+        if is_async is None:
+            is_async = inspect.iscoroutinefunction(func)
+        entry = Precondition(
+            func, is_async, priority, guilds, override, next(self._counter)
+        )
+        self._registered.append(entry)
+        self._dirty = True
+        return entry
+
+    def unregister(self, func):
+        """Removes every registration of a precondition."""
+        self._registered = [x for x in self._registered if x.func != func]
+        self._dirty = True
+
+    def entries(self):
+        if self._is_stale():
+            self.compile()
+        return self._registered + list(self._legacy_entries.values())
+
+    def _legacy_entry(self, func, override):
+        key = (id(func), override)
+        entry = self._legacy_entries.get(key)
+        if entry is None or entry.func is not func:
+            entry = Precondition(
+                func, None, 0, None, override, next(self._counter)
+            )
+        return key, entry
+
+    def _is_stale(self):
+        versions = (self.legacy.version, self.legacy_overrides.version)
+        return self._dirty or versions != self._versions
+
+    def compile(self):
+        legacy = {}
+        for funcs, override in (
+            (self.legacy_overrides, True),
+            (self.legacy, False),
+        ):
+            for func in funcs:
+                key, entry = self._legacy_entry(func, override)
+                legacy[key] = entry
+        self._legacy_entries = legacy
+
+        # overrides first, then by priority, sync before async, and finally
+        # in the order they were registered
+        entries = self._registered + list(legacy.values())
+        entries.sort(
+            key=lambda x: (
+                not x.override,
+                -x.priority,
+                x.is_async is not False,
+                x.order,
+            )
+        )
+        guilds = set()
+        for entry in entries:
+            if entry.guilds is not None:
+                guilds.update(entry.guilds)
+        self._default = tuple(x for x in entries if x.guilds is None)
+        self._by_guild = {
+            guild_id: tuple(
+                x for x in entries if x.guilds is None or guild_id in x.guilds
+            )
+            for guild_id in guilds
+        }
+        self._versions = (self.legacy.version, self.legacy_overrides.version)
+        self._dirty = False
+
+    def _remove(self, entry):
+        logger.exception(
+            f'Removed precondition{" override" if entry.override else ""} '
+            f'"{entry.name}", it was malfunctioning.'
+        )
+        if entry.is_async is None:  # only legacy preconditions are undeclared
+            funcs = self.legacy_overrides if entry.override else self.legacy
+            if entry.func in funcs:
+                funcs.remove(entry.func)
+        elif entry in self._registered:
+            self._registered.remove(entry)
+        self._dirty = True
+
+    async def run(self, message) -> bool:
+        """Returns whether a message should go on to command processing."""
+        if self._is_stale():
+            self.compile()
+        guild = message.guild
+        if guild is None:
+            pipeline = self._default
+        else:
+            pipeline = self._by_guild.get(guild.id, self._default)
+        for entry in pipeline:
+            start = time.perf_counter()
+            # noinspection PyBroadException
+            try:
+                if entry.is_async:
+                    out = await entry.func(message)
+                else:
+                    out = entry.func(message)
+                    if entry.is_async is None and inspect.isawaitable(out):
+                        out = await out
+            except Exception:
+                entry.errors += 1
+                self._remove(entry)
+                continue
+            finally:
+                entry.calls += 1
+                entry.time += time.perf_counter() - start
+            if entry.override:
+                if out is True:
+                    return True
+            elif out is False:
+                entry.rejections += 1
+                return False
+        return True
@@ -0,0 +1,97 @@
+import logging
+
+from disnake.ext import commands
+
+logger = logging.getLogger('heleus')
+
+
+class MessagePrefilter:
+    """Rejects messages that can't be commands before any awaits happen.
+
+    Prefixes are precomputed from the bot's user ID and command prefix, so
+    checking a message is a single ``str.startswith`` call. Cogs that need
+    to see messages without a prefix can register a hook, a synchronous
+    callable taking the message and returning True to let it through.
+    """
+
+    def __init__(self, heleus):
+        self.heleus = heleus
+        self.filtered = 0
+        self.processed = 0
+        self._prefixes = set()
+        self._hooks = []
+        self._user_id = None
+        self._compiled = ()
+
+    def add_prefix(self, prefix: str):
+        """Lets messages starting with a prefix through the prefilter."""
+        self._prefixes.add(prefix)
+        self._user_id = None  # recompile on the next message
+
+    def remove_prefix(self, prefix: str):
+        self._prefixes.discard(prefix)
+        self._user_id = None
+
+    def add_hook(self, func):
+        """Lets messages through if ``func(message)`` returns True."""
+        self._hooks.append(func)
+
+    def remove_hook(self, func):
+        if func in self._hooks:
+            self._hooks.remove(func)
+
+    def compile(self):
+        user_id = self.heleus.user.id
+        prefix = self.heleus.command_prefix
+        prefixes = set(self._prefixes)
+        if prefix is commands.when_mentioned:
+            prefixes.update((f'<@{user_id}> ', f'<@!{user_id}> '))
+        elif isinstance(prefix, str):
+            prefixes.add(prefix)
+        elif isinstance(prefix, (list, tuple)):
+            prefixes.update(prefix)
+        else:  # prefixes are dynamic, so every message has to go through
+            prefixes = None
+        self._compiled = tuple(prefixes) if prefixes is not None else None
+        self._user_id = user_id
+
+    def _run_hooks(self, message):
+        for hook in list(self._hooks):
+            # noinspection PyBroadException
+            try:
+                if hook(message) is True:
+                    return True
+            except Exception:
+                logger.exception(
+                    f'Removed prefilter hook "{hook.__name__}", it was malfunctioning.'
+                )
+                self._hooks.remove(hook)
+        return False
+
+    def check(self, message) -> bool:
+        """Returns whether a message should go on to command processing."""
+        user = self.heleus.user
+        if user is None:
+            self.filtered += 1
+            return False
+        if user.id != self._user_id:
+            self.compile()
+        if (
+            self._compiled is None
+            or message.content.startswith(self._compiled)
+            or (self._hooks and self._run_hooks(message))
+        ):
+            self.processed += 1
+            return True
+        self.filtered += 1
+        return False
+
+    def strip_prefix(self, message):
+        """Returns a message's content without its prefix, or None."""
+        if not self._compiled:
+            return None
+        content = message.content
+        for prefix in self._compiled:
+            if content.startswith(prefix):
+                return content[len(prefix) :]
+        return None
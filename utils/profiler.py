@@ -0,0 +1,180 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger('heleus')
+
+MODES = ('sample', 'cprofile')
+# seconds past its length a session stops itself, if it wasn't stopped
+SESSION_MARGIN = 30
+
+# the session running in this process, there's only ever one
+_session = None
+_session_lock = threading.Lock()
+
+
+def call_in_loop(loop, func, timeout=5):
+    """Runs a function on the event loop's thread, waiting for its result.
+
+    Must be called from another thread, as RPCs are.
+    """
+    future = concurrent.futures.Future()
+
+    def run():
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+
+    loop.call_soon_threadsafe(run)
+    return future.result(timeout)
+
+
+def _label(code):
+    filename = os.path.basename(code.co_filename)
+    return f'{code.co_qualname} ({filename}:{code.co_firstlineno})'.replace(
+        ';', ':'
+    )
+
+
+class SamplingProfiler:
+    """Samples a thread's stack from another thread, like py-spy does.
+
+    The result is in the collapsed stack format flame graph tools read,
+    one line of semicolon separated frames and a sample count per stack.
+    """
+
+    mode = 'sample'
+    deadline = None  # a timer stopping the session, see start_profiling
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._labels = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            name='sampling profiler', target=self._run, daemon=True
+        )
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread.start()
+
+    def _run(self):
+        labels = self._labels
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _label(code)
+                stack.append(label)
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self, loop) -> bytes:
+        self._stopped.set()
+        self._thread.join()
+        lines = (
+            f'{";".join(stack)} {count}'
+            for stack, count in self.stacks.most_common()
+        )
+        return '\n'.join(lines).encode()
+
+
+class CProfileProfiler:
+    """Runs cProfile on the event loop's thread.
+
+    The result is a marshalled stats dict, which is what pstats and
+    snakeviz load.
+    """
+
+    mode = 'cprofile'
+    deadline = None
+
+    def __init__(self, loop):
+        import cProfile
+
+        self.loop = loop
+        self.profile = cProfile.Profile()
+        self.samples = None
+
+    def start(self):
+        call_in_loop(self.loop, self.profile.enable)
+        self.started = time.monotonic()
+
+    def stop(self, loop) -> bytes:
+        import marshal
+
+        call_in_loop(loop, self.profile.disable)
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+def start_profiling(heleus, mode='sample', seconds=None):
+    """Starts a profiling session on this shard, an RPC.
+
+    Sessions given a length stop themselves shortly after it, in case
+    stop_profiling never arrives.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            return f'A {_session.mode} session is already running.'
+        if mode == 'cprofile':
+            profiler = CProfileProfiler(heleus.loop)
+        else:
+            thread_id = call_in_loop(heleus.loop, threading.get_ident)
+            profiler = SamplingProfiler(thread_id)
+        profiler.start()
+        _session = profiler
+    if seconds is not None:
+        profiler.deadline = threading.Timer(
+            seconds + SESSION_MARGIN, _expire, (heleus, profiler)
+        )
+        profiler.deadline.daemon = True
+        profiler.deadline.start()
+    return None
+
+
+def _expire(heleus, profiler):
+    global _session
+    with _session_lock:
+        if _session is not profiler:
+            return
+        _session = None
+    # noinspection PyBroadException
+    try:
+        profiler.stop(heleus.loop)
+    except Exception:
+        logger.exception('Unable to stop an expired profiling session.')
+    logger.warning(f'Stopped a {profiler.mode} session nobody collected.')
+
+
+def stop_profiling(heleus):
+    """Stops this shard's profiling session, an RPC.
+
+    Returns the mode, the seconds profiled, the sample count (None for
+    cProfile) and the profile's contents.
+    """
+    global _session
+    with _session_lock:
+        profiler, _session = _session, None
+    if profiler is None:
+        return None
+    if profiler.deadline is not None:
+        profiler.deadline.cancel()
+    data = profiler.stop(heleus.loop)
+    duration = time.monotonic() - profiler.started
+    return profiler.mode, duration, profiler.samples, data
@@ -0,0 +1,274 @@
+import asyncio
+import collections
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import traceback
+import urllib.parse
+import uuid
+
+from utils import metrics
+
+CLIENT = 'heleus/1.0'
+logger = logging.getLogger('heleus')
+
+
+def parse_dsn(dsn):
+    """Returns the store URL and auth header for a Sentry DSN.
+
+    Raises ValueError if the DSN can't be parsed.
+    """
+    url = urllib.parse.urlsplit(dsn)
+    path, _, project = url.path.rpartition('/')
+    if not (url.scheme and url.hostname and url.username and project):
+        raise ValueError(f'Invalid DSN {dsn!r}')
+    netloc = url.hostname + (f':{url.port}' if url.port else '')
+    store = f'{url.scheme}://{netloc}{path}/api/{project}/store/'
+    auth = (
+        f'Sentry sentry_version=7, sentry_client={CLIENT}, '
+        f'sentry_key={url.username}'
+    )
+    if url.password:
+        auth += f', sentry_secret={url.password}'
+    return store, auth
+
+
+def _frames(tb):
+    frames = []
+    for frame, lineno in traceback.walk_tb(tb):
+        code = frame.f_code
+        frames.append(
+            {
+                'filename': code.co_filename,
+                'function': code.co_name,
+                'module': frame.f_globals.get('__name__'),
+                'lineno': lineno,
+            }
+        )
+    return frames
+
+
+def _exception(exception):
+    values = []
+    seen = set()
+    while exception is not None and id(exception) not in seen:
+        seen.add(id(exception))
+        values.append(
+            {
+                'type': type(exception).__name__,
+                'module': type(exception).__module__,
+                'value': str(exception),
+                'stacktrace': {'frames': _frames(exception.__traceback__)},
+            }
+        )
+        if exception.__cause__ is not None:
+            exception = exception.__cause__
+        elif not exception.__suppress_context__:
+            exception = exception.__context__
+        else:
+            exception = None
+    values.reverse()  # Sentry wants the outermost exception last
+    return {'values': values}
+
+
+class SentryReporter:
+    """Queues events for Sentry, sending them in batches from a task.
+
+    Capturing only builds the event and appends it to a bounded queue, so
+    it's safe from any thread and never waits on the network. When the
+    endpoint is slow and the queue fills up, the oldest events are
+    dropped.
+    """
+
+    def __init__(
+        self,
+        dsn,
+        sample_rate=1.0,
+        max_queue=100,
+        batch_size=10,
+        interval=1.0,
+        tags=None,
+    ):
+        self.url, self.auth = parse_dsn(dsn)
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.interval = interval
+        self.tags = tags or {}
+        self.queue = collections.deque(maxlen=max_queue)
+        self.counts = collections.Counter()  # result -> events
+        self._task = None
+        metrics.Counter(
+            'heleus_sentry_events',
+            'Events captured for Sentry, by what happened to them.',
+            labels=('result',),
+            callback=lambda: [((k,), v) for k, v in self.counts.items()],
+        )
+
+    def start(self, loop):
+        if self._task is None:
+            self._task = loop.create_task(self._worker())
+
+    async def close(self, timeout=5.0):
+        """Stops the worker, sending what's still queued within a timeout."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if not self.queue:
+            return
+        import aiohttp
+
+        async def drain():
+            async with aiohttp.ClientSession() as session:
+                while self.queue:
+                    await self._send_batch(session)
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            self.counts['dropped'] += len(self.queue)
+            self.queue.clear()
+
+    def _enqueue(self, event):
+        if random.random() >= self.sample_rate:
+            self.counts['sampled_out'] += 1
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.counts['dropped'] += 1
+        self.counts['queued'] += 1
+        self.queue.append(event)
+
+    def _event(self, level, logger_name, extra, tags):
+        return {
+            'event_id': uuid.uuid4().hex,
+            'timestamp': time.time(),
+            'level': level,
+            'logger': logger_name,
+            'platform': 'python',
+            'server_name': platform.node(),
+            'tags': {**self.tags, **(tags or {})},
+            'extra': extra or {},
+            'contexts': {
+                'runtime': {'name': 'CPython', 'version': sys.version}
+            },
+        }
+
+    def capture_exception(
+        self, exception, logger_name='heleus', extra=None, tags=None
+    ):
+        event = self._event('error', logger_name, extra, tags)
+        event['exception'] = _exception(exception)
+        self._enqueue(event)
+
+    def capture_message(
+        self,
+        message,
+        level='info',
+        logger_name='heleus',
+        extra=None,
+        tags=None,
+    ):
+        event = self._event(level, logger_name, extra, tags)
+        event['message'] = {'formatted': message}
+        self._enqueue(event)
+
+    async def _worker(self):
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self._send_batch(session)
+
+    async def _send_batch(self, session):
+        batch = []
+        while self.queue and len(batch) < self.batch_size:
+            batch.append(self.queue.popleft())
+        await asyncio.gather(*[self._send(session, x) for x in batch])
+
+    async def _send(self, session, event):
+        import aiohttp
+
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': CLIENT,
+            'X-Sentry-Auth': self.auth,
+        }
+        try:
+            async with session.post(
+                self.url, data=json.dumps(event, default=str), headers=headers
+            ) as response:
+                if response.status == 200:
+                    self.counts['sent'] += 1
+                else:
+                    self.counts['failed'] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.counts['failed'] += 1
+
+
+class SentryHandler(logging.Handler):
+    """Captures log records as Sentry events.
+
+    Records logged with ``extra={'reported': True}`` are skipped, for
+    errors that were already captured with more detail.
+    """
+
+    def __init__(self, reporter, level=logging.ERROR):
+        super().__init__(level)
+        self.reporter = reporter
+
+    def emit(self, record):
+        if getattr(record, 'reported', False):
+            return
+        extra = {'message': record.getMessage()}
+        tags = {'shard_id': getattr(record, 'shard_id', None)}
+        exception = record.exc_info[1] if record.exc_info else None
+        if isinstance(exception, BaseException):
+            self.reporter.capture_exception(
+                exception, record.name, extra, tags
+            )
+        else:
+            self.reporter.capture_message(
+                record.getMessage(),
+                record.levelname.lower(),
+                record.name,
+                tags=tags,
+            )
+
+
+async def start_sink(host='127.0.0.1', port=9000, project='1'):
+    """Starts a stand-in Sentry server, for testing reporting locally.
+
+    Point HELEUS_SENTRY_DSN at http://key@host:port/project to use it.
+    Received events are logged and kept in the returned list.
+    """
+    from utils.http import start_server
+
+    events = []
+
+    async def store(method, headers, body):
+        if method != 'POST':
+            return 405, 'text/plain', b'method not allowed'
+        event = json.loads(body)
+        events.append(event)
+        logger.info(
+            f'Sentry sink received a {event.get("level")} event '
+            f'{event.get("event_id")}'
+        )
+        return 200, 'application/json', b'{}'
+
+    server = await start_server({f'/api/{project}/store/': store}, host, port)
+    return server, events
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    async def main():
+        await start_sink(port=int(sys.argv[1]) if len(sys.argv) > 1 else 9000)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
@@ -1,7 +1,18 @@
 import typing
 
-import coredis
-import dill
+from utils.lazy import lazy_import
+from utils.metrics import Histogram
+
+dill = lazy_import('dill')
+
+if typing.TYPE_CHECKING:
+    import coredis
+
+_latency = Histogram(
+    'heleus_redis_command_duration_seconds',
+    'Time taken by Redis commands issued through RedisCollection.',
+    labels=('command',),
+)
 
 
 class _Nonexistant:
@@ -11,7 +22,7 @@ class _Nonexistant:
 class RedisCollection:
     __slots__ = ('redis', 'key')
 
-    def __init__(self, redis: coredis.Redis, key):
+    def __init__(self, redis: 'coredis.Redis', key):
         self.redis = redis
         self.key = key
 
@@ -22,27 +33,34 @@ class RedisCollection:
 
     async def get(self, key, default=None) -> typing.Any:
         """Gets a key from the collection."""
-        out = await self.redis.hget(self.key, dill.dumps(key))
+        with _latency.time('hget'):
+            out = await self.redis.hget(self.key, dill.dumps(key))
         if out is None:
             return default
         return dill.loads(out)
 
     async def set(self, key, value):
         """Sets a key in the collection."""
-        await self.redis.hset(self.key, {dill.dumps(key): dill.dumps(value)})
+        with _latency.time('hset'):
+            await self.redis.hset(
+                self.key, {dill.dumps(key): dill.dumps(value)}
+            )
 
     async def delete(self, key):
         """Removes a key. Does nothing if the key doesn't exist."""
-        await self.redis.hdel(self.key, [dill.dumps(key)])
+        with _latency.time('hdel'):
+            await self.redis.hdel(self.key, [dill.dumps(key)])
 
     async def keys(self) -> typing.List[typing.Any]:
         """Lists all keys."""
-        _keys = await self.redis.hkeys(self.key)
+        with _latency.time('hkeys'):
+            _keys = await self.redis.hkeys(self.key)
         return [dill.loads(x) for x in _keys]
 
     async def to_dict(self) -> dict:
         """Returns the collection as a Python dictionary."""
-        res = await self.redis.hgetall(self.key)
+        with _latency.time('hgetall'):
+            res = await self.redis.hgetall(self.key)
         out = {}
         for key, value in dict(res).items():
             out[dill.loads(key)] = dill.loads(value)
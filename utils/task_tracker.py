@@ -0,0 +1,101 @@
+import asyncio
+import collections
+import io
+import time
+import weakref
+
+from disnake.ext import tasks
+
+
+class TaskTracker:
+    """Records when asyncio tasks were created, through a task factory.
+
+    Tasks are weakly referenced, so tracking never keeps a finished task
+    alive. Any task factory that was already installed is still used.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.created = weakref.WeakKeyDictionary()  # task -> time.monotonic
+        self.count = 0
+        self._factory = None
+
+    def install(self):
+        self._factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._create_task)
+
+    def _create_task(self, loop, coro, **kwargs):
+        if self._factory is None:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        else:
+            task = self._factory(loop, coro, **kwargs)
+        self.created[task] = time.monotonic()
+        self.count += 1
+        return task
+
+    def age(self, task):
+        created = self.created.get(task)
+        return None if created is None else time.monotonic() - created
+
+
+def _name(coro):
+    """Returns a coroutine's name, or the function a tasks.loop runs."""
+    frame = getattr(coro, 'cr_frame', None)
+    owner = frame.f_locals.get('self') if frame is not None else None
+    if isinstance(owner, tasks.Loop):
+        return f'tasks.loop({owner.coro.__qualname__})'
+    return getattr(coro, '__qualname__', type(coro).__name__)
+
+
+def _awaiting(coro):
+    """Returns the innermost coroutine a task is suspended in."""
+    while hasattr(getattr(coro, 'cr_await', None), 'cr_await'):
+        coro = coro.cr_await
+    return getattr(coro, '__qualname__', type(coro).__name__)
+
+
+def snapshot_tasks(heleus, stacks=False):
+    """Groups a shard's pending tasks by coroutine, an RPC.
+
+    Reading tasks from outside the loop thread is best effort, but works
+    even while the loop is stuck, which is when it's most useful.
+    """
+    tracker = heleus.task_tracker
+    groups = {}
+    for task in asyncio.all_tasks(heleus.loop):
+        coro = task.get_coro()
+        name = _name(coro)
+        group = groups.get(name)
+        if group is None:
+            group = groups[name] = {
+                'name': name,
+                'count': 0,
+                'oldest': None,
+                'newest': None,
+                'awaiting': collections.Counter(),
+                'stack': None,
+            }
+        group['count'] += 1
+        group['awaiting'][_awaiting(coro)] += 1
+        age = tracker.age(task)
+        oldest = age is not None and (
+            group['oldest'] is None or age > group['oldest']
+        )
+        if oldest:
+            group['oldest'] = age
+        if age is not None and (
+            group['newest'] is None or age < group['newest']
+        ):
+            group['newest'] = age
+        # keep the stack of the oldest task, as that's the likely leak
+        if stacks and (oldest or group['stack'] is None):
+            stack = io.StringIO()
+            task.print_stack(limit=20, file=stack)
+            group['stack'] = stack.getvalue()
+    for group in groups.values():
+        group['awaiting'] = group['awaiting'].most_common(1)[0][0]
+    return {
+        'tasks': sorted(groups.values(), key=lambda x: -x['count']),
+        'created': tracker.count,
+        'rpc_futures': len(heleus._pubsub_futures),
+    }
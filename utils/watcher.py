@@ -0,0 +1,189 @@
+import asyncio
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+logger = logging.getLogger('heleus')
+
+# inotify events that mean a file in a watched directory may have changed,
+# including editors that save by renaming a temporary file over the original
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def module_files(extension) -> list:
+    """Returns the source files of an extension and its submodules."""
+    files = []
+    for name, module in list(sys.modules.items()):
+        if name != extension and not name.startswith(f'{extension}.'):
+            continue
+        path = getattr(module, '__file__', None)
+        if path and path.endswith('.py'):
+            files.append(os.path.abspath(path))
+    return files
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class _Inotify:
+    """Waits for changes to directories with inotify, through libc."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}  # directory -> watch descriptor
+
+    def watch(self, directories):
+        for directory in set(self.watches) - set(directories):
+            self.libc.inotify_rm_watch(self.fd, self.watches.pop(directory))
+        for directory in set(directories) - set(self.watches):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd >= 0:
+                self.watches[directory] = wd
+
+    def wait(self, timeout):
+        """Returns whether anything changed within the timeout."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass  # which files changed is worked out from their hashes
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    """Waits for changes to files by polling their modification times."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.files = []
+        self.stats = {}
+
+    def _stat(self):
+        stats = {}
+        for path in self.files:
+            try:
+                st = os.stat(path)
+                stats[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stats[path] = None
+        return stats
+
+    def watch(self, files):
+        self.files = list(files)
+        self.stats = self._stat()
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        stats = self._stat()
+        changed, self.stats = stats != self.stats, stats
+        return changed
+
+    def close(self):
+        pass
+
+
+class CogWatcher:
+    """Watches the source of loaded extensions, reporting the changed ones.
+
+    Changes are detected with inotify where available, falling back to
+    polling, then confirmed by hashing the files so that saving a file
+    without changing it, or touching it, doesn't count. Changes are
+    collected for `debounce` seconds, so that saving several files at once
+    reports them together.
+    """
+
+    def __init__(self, loop, callback, debounce=1.0, interval=2.0):
+        self.loop = loop
+        self.callback = callback  # coroutine function taking extensions
+        self.debounce = debounce
+        self.hashes = {}  # extension -> {path: hash}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        try:
+            self._backend = _Inotify()
+            self.mode = 'inotify'
+        except (OSError, AttributeError, TypeError):
+            self._backend = _Poller(interval)
+            self.mode = 'polling'
+        self._thread = threading.Thread(
+            name='cog watcher', target=self._run, daemon=True
+        )
+
+    def watch(self, extensions):
+        """Sets the extensions to watch, hashing their current source."""
+        if set(extensions) == set(self.hashes):
+            return
+        hashes = {
+            x: {path: file_hash(path) for path in module_files(x)}
+            for x in extensions
+        }
+        files = [path for x in hashes.values() for path in x]
+        with self._lock:
+            self.hashes = hashes
+            if self.mode == 'inotify':
+                self._backend.watch({os.path.dirname(x) for x in files})
+            else:
+                self._backend.watch(files)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f'Watching cog source for changes using {self.mode}.')
+
+    def stop(self):
+        self._stop.set()
+
+    def changed(self) -> list:
+        """Returns the extensions whose source changed since last checked."""
+        changed = []
+        with self._lock:
+            for extension, files in self.hashes.items():
+                new = {path: file_hash(path) for path in files}
+                if new != files:
+                    self.hashes[extension] = new
+                    changed.append(extension)
+        return changed
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                if not self._backend.wait(1.0):
+                    continue
+                # let the rest of a save, or of a deploy, land
+                while self._backend.wait(self.debounce):
+                    if self._stop.is_set():
+                        return
+                changed = self.changed()
+                if changed:
+                    asyncio.run_coroutine_threadsafe(
+                        self.callback(changed), self.loop
+                    )
+        finally:
+            self._backend.close()
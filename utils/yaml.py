@@ -1,26 +1,83 @@
+import collections
+import copy
 import strictyaml
 import os
 import errno
 import logging
 
+from utils.metrics import Counter, get_or_create
+
 logger = logging.getLogger('heleus')
 
 folder = os.environ.get('HELEUS_CONFIG', 'config')
 
+# parsed documents are kept until their file changes, as strictyaml is slow
+_cache = {}  # file -> (schema, path, stamp, data)
+_registered = {}  # file -> schema, parsed by preload
+stats = collections.Counter()  # hits, parses and reparses
 
-def get(file: str, schema: strictyaml.Map = None):
+get_or_create(
+    Counter,
+    'heleus_yaml_documents',
+    'YAML documents read, by whether they were cached or parsed.',
+    labels=('result',),
+).callback = lambda: [((k,), v) for k, v in stats.items()]
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _resolve(file):
     path = f'{folder}/{file}'
-    if not os.path.exists(path):
-        path += '.yml'
-    if not os.path.exists(path):
+    try:
+        return path, _stamp(path)
+    except FileNotFoundError:
+        pass
+    try:
+        return path + '.yml', _stamp(path + '.yml')
+    except FileNotFoundError:
         raise FileNotFoundError(
             errno.ENOENT, os.strerror(errno.ENOENT), f'{folder}/{file}'
-        )
+        ) from None
+
+
+def _load(file, schema):
+    """Returns a cached document, parsing it if it's new or has changed.
+
+    One document is kept per file, so pass the same schema object for a
+    file each time, such as one defined at module level, or it is parsed
+    again on every call.
+    """
+    entry = _cache.get(file)
+    if entry is not None:
+        cached_schema, path, stamp, data = entry
+        try:
+            if cached_schema is schema and _stamp(path) == stamp:
+                stats['hits'] += 1
+                return data
+        except FileNotFoundError:
+            pass
+    path, stamp = _resolve(file)
     with open(path, 'r') as f:
-        return strictyaml.load(f.read(), schema).data
+        data = strictyaml.load(f.read(), schema).data
+    stats['reparses' if entry is not None else 'parses'] += 1
+    _cache[file] = (schema, path, stamp, data)
+    return data
+
+
+def get(file: str, schema: strictyaml.Map = None):
+    return copy.deepcopy(_load(file, schema))
 
 
 def get_safe(file: str, schema: strictyaml.Map = None):
+    """Returns a document, or None if it's missing or fails to parse.
+
+    Documents are cached per file, so a file read with two different
+    schemas is parsed again each time the schema changes. Read a file with
+    a single schema, defined at module level.
+    """
     try:
         return get(file, schema)
     except FileNotFoundError:
@@ -28,3 +85,27 @@ def get_safe(file: str, schema: strictyaml.Map = None):
     except Exception:
         logger.exception(f'Failed to parse help file: {file}')
         return None
+
+
+def register(file: str, schema: strictyaml.Map = None):
+    """Registers a document to be parsed ahead of use by preload.
+
+    Cogs should register their help documents when they're loaded.
+    """
+    _registered[file] = schema
+
+
+def preload():
+    """Parses every registered document that exists and isn't cached yet.
+
+    Returns how many documents are cached. Failures are logged, and raised
+    again when the document is used.
+    """
+    for file, schema in list(_registered.items()):
+        try:
+            _load(file, schema)
+        except FileNotFoundError:
+            continue
+        except Exception:
+            logger.exception(f'Failed to preload {file}')
+    return len(_cache)